@@ -0,0 +1,236 @@
+import pandas as pd
+import numpy as np
+import geopandas as gpd
+import argparse
+import os
+
+if __package__:
+    from . import coal, sites, instrument
+    from .instrument import logger
+else:  # run as a script, or imported from the repository directory
+    import coal
+    import sites
+    import instrument
+    from instrument import logger
+
+EARTH_RADIUS_KM = 6371.0
+
+# Site location columns: never averaged into supply tables
+LOCATION_COLUMNS = ['lat', 'lon', 'wtkLat', 'wtkLon', 'nsrdbLat', 'nsrdbLon']
+
+# Resource class labels (windClass, or windClass_{height}m with several hub heights): never averaged either
+CLASS_PREFIX = 'windClass'
+
+# CLI arguments
+parser = argparse.ArgumentParser(description='Regional supply tables of wind/solar site results, and the renewable '
+                                             'sites around coal plants')
+parser.add_argument('--sites', type=str, required=True,
+                    help='Site results CSV, e.g. wind_data_output/wind_costs.csv (wide or --tidy output)')
+parser.add_argument('--regions', type=str, default=None,
+                    help='Region polygons (any file geopandas reads, e.g. balancing areas). Default: the state '
+                         'polygons (states/s_11au16.shp, or the state index when built)')
+parser.add_argument('--region_field', type=str, default='STATE',
+                    help='Attribute of the region polygons that names each region, default STATE')
+parser.add_argument('--class_column', type=str, default=None,
+                    help='Resource class column to split supply tables by. Default: windClass when the sites have it')
+parser.add_argument('--plants', type=str, default=None,
+                    help='Coal plant locations CSV (ORIS_ID, lat, lon, or the EIA-860 Plant Code, Latitude, '
+                         'Longitude columns) to relate sites to the coal plants of --coal_year')
+parser.add_argument('--coal_year', type=int, choices=coal.DATA_YEARS, default=2020,
+                    help="Year of the coal.py outputs (coal_costs_total{year}.csv) the plants are taken from, "
+                         "default 2020")
+parser.add_argument('--radius_km', type=float, default=50.0,
+                    help='Plant neighborhoods: sites within this distance of their nearest coal plant, default 50')
+parser.add_argument('--out_dir', type=str, default=None, help='Output directory, default that of --sites')
+instrument.addArguments(parser)
+
+
+def loadRegions(path=None, field='STATE'):
+    """ Region polygons (lat/lon) with their name field: a region file, or every state polygon by default """
+
+    if path is None:
+        regions = sites.readStateIndex()
+        if regions is None:
+            regions = gpd.read_file(sites.STATES_SHP)
+    else:
+        regions = gpd.read_file(path)
+        if regions.crs is not None and not regions.crs.is_geographic:
+            regions = regions.to_crs(epsg=4326)
+
+    if field not in regions:
+        raise ValueError(f'No {field} field in the region polygons, available: {list(regions.columns)}')
+
+    return regions[[field, 'geometry']].reset_index(drop=True)
+
+
+def assignRegions(siteData, regions, field='STATE'):
+    """ Site results with the region containing each site (None outside every region). Each distinct location is
+    tested once, with bulk point-in-polygon tests per region """
+
+    coords = siteData[['lat', 'lon']].drop_duplicates()
+    owner = sites.pointOwners(regions, coords['lat'].to_numpy(), coords['lon'].to_numpy())
+
+    coords[field] = np.where(owner >= 0, regions[field].to_numpy()[owner], None)
+
+    return siteData.merge(coords, on=['lat', 'lon'], how='left')
+
+
+def supplyTable(siteData, by, class_column=None):
+    """ Supply table per group (e.g. region) and resource class: number of sites, and the mean of every other
+    numeric column (resource, elevation, CAPEX/FOPEX by year) except locations and class labels. Tidy site results
+    are also split by YEAR """
+
+    keys = [by] + ([class_column] if class_column else []) + (['YEAR'] if 'YEAR' in siteData else [])
+    values = [c for c in siteData.select_dtypes('number')
+              if c not in keys and c not in LOCATION_COLUMNS and not c.startswith(CLASS_PREFIX)]
+
+    grouped = siteData.dropna(subset=[by]).groupby(keys, observed=True)
+    table = grouped[values].mean()
+    table.insert(0, 'sites', grouped.size())
+
+    return table
+
+
+def unitVectors(lat, lon):
+    """ (lat, lon) degrees --> points on the unit sphere (n x 3) """
+
+    lat, lon = np.radians(lat), np.radians(lon)
+
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class PlantIndex:
+    """ Nearest coal plants of any set of points, exact on the sphere.
+
+    Plants are stored as unit vectors, where the largest dot product is the smallest great-circle distance; points
+    are queried in blocks with one matrix product each, so memory stays bounded. With a few hundred plants this is
+    as fast as a tree index, and needs no extra dependency """
+
+    def __init__(self, plants):
+        self.plants = plants.reset_index(drop=True)
+        self.xyz = unitVectors(self.plants['lat'].to_numpy(), self.plants['lon'].to_numpy())
+
+    def query(self, lat, lon, k=1, block_cells=2 ** 16):
+        """ Row numbers of the k nearest plants of every point (n x k, nearest first), and distances (km). Without
+        any plants every match is -1, at NaN distance """
+
+        points = unitVectors(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64))
+
+        if not len(self.xyz):
+            return np.full((len(points), k), -1, dtype=np.int64), np.full((len(points), k), np.nan)
+
+        k = min(k, len(self.xyz))
+
+        nearest = np.empty((len(points), k), dtype=np.int64)
+        cosine = np.empty((len(points), k))
+
+        step = max(1, block_cells // len(self.xyz))
+        for start in range(0, len(points), step):
+            dots = points[start:start + step] @ self.xyz.T
+
+            if k == 1:
+                top = dots.argmax(axis=1)[:, None]
+            else:
+                top = np.argpartition(-dots, k - 1, axis=1)[:, :k] if k < dots.shape[1] else np.argsort(-dots, axis=1)
+                top = np.take_along_axis(top, np.argsort(-np.take_along_axis(dots, top, axis=1), axis=1), axis=1)
+
+            nearest[start:start + step] = top
+            cosine[start:start + step] = np.take_along_axis(dots, top, axis=1)
+
+        return nearest, EARTH_RADIUS_KM * np.arccos(np.clip(cosine, -1, 1))
+
+
+def readPlantLocations(path):
+    """ Plant locations CSV --> ORIS_ID, lat, lon (EIA-860 column names are accepted) """
+
+    plants = pd.read_csv(path).rename(columns={'Plant Code': 'ORIS_ID', 'Latitude': 'lat', 'Longitude': 'lon'})
+
+    return plants[['ORIS_ID', 'lat', 'lon']].dropna()
+
+
+def nearestPlants(siteData, index):
+    """ Nearest coal plant (ORIS_ID) and its distance (km) for every distinct site location; missing (NaN
+    distance) when the index has no plants """
+
+    coords = siteData[['lat', 'lon']].drop_duplicates().reset_index(drop=True)
+    nearest, distance = index.query(coords['lat'], coords['lon'])
+
+    oris_ids = pd.array(index.plants['ORIS_ID'], dtype='Int64')
+    coords['ORIS_ID'] = oris_ids.take(nearest[:, 0], allow_fill=True)
+    coords['plant_distance_km'] = distance[:, 0]
+
+    return coords
+
+
+def plantNeighborhoods(siteData, index, radius_km=50.0, class_column=None):
+    """ Supply table of the sites within radius_km of each coal plant (every site counts for its nearest plant
+    only), joined with the plant's data. Every plant in the index is kept: plants without sites in range get one
+    row with 0 sites and empty (NaN) site columns """
+
+    near = nearestPlants(siteData, index)
+    near = near[near['plant_distance_km'] <= radius_km]
+
+    table = supplyTable(siteData.merge(near, on=['lat', 'lon']), 'ORIS_ID', class_column)
+    keys = table.index.names
+    plants = index.plants.drop(columns=['lat', 'lon'])
+
+    table = table.reset_index()
+    integer_keys = [key for key in keys if pd.api.types.is_integer_dtype(table[key])]
+
+    table = plants[['ORIS_ID']].merge(table, on='ORIS_ID', how='left')
+    table['sites'] = table['sites'].fillna(0).astype(np.int64)
+    # Class and YEAR labels stay integers next to the empty rows
+    table[integer_keys] = table[integer_keys].astype('Int64')
+    table = table.merge(plants, on='ORIS_ID', suffixes=('', '_plant'))
+
+    return table.set_index(keys).sort_index()
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    instrument.configure(args)
+
+    out_dir = args.out_dir or os.path.dirname(os.path.abspath(args.sites))
+    stem = os.path.splitext(os.path.basename(args.sites))[0]
+    os.makedirs(out_dir, exist_ok=True)
+
+    with instrument.run(args):
+        with instrument.stage('read') as stage:
+            siteData = pd.read_csv(args.sites, float_precision='round_trip')
+            stage.rows_out = len(siteData)
+
+        class_column = args.class_column or ('windClass' if 'windClass' in siteData else None)
+
+        with instrument.stage('regions', rows_in=len(siteData)) as stage:
+            siteData = assignRegions(siteData, loadRegions(args.regions, args.region_field), args.region_field)
+            stage.rows_out = int(siteData[args.region_field].notna().sum())
+
+        outside = siteData[args.region_field].isna().sum()
+        if outside:
+            logger.info(f'{outside} site rows outside every region are left out')
+
+        with instrument.stage('supply', rows_in=len(siteData)) as stage:
+            supply = supplyTable(siteData, args.region_field, class_column)
+            stage.rows_out = len(supply)
+
+        supply_path = os.path.join(out_dir, f'{stem}_supply_{args.region_field}.csv')
+        supply.to_csv(supply_path)
+        logger.info(f'{len(supply)} region supply rows --> {supply_path}')
+
+        if args.plants is not None:
+            costs = pd.read_csv(coal.outputPaths(args.coal_year)['coal_costs_total'])
+            # Plants with regulated and unregulated receipts have two cost rows; one location each is enough
+            plants = readPlantLocations(args.plants).merge(costs.drop_duplicates('ORIS_ID'), on='ORIS_ID')
+            logger.info(f'{len(plants)} coal plants of {args.coal_year} with locations')
+
+            with instrument.stage('plants', rows_in=len(siteData)) as stage:
+                neighborhoods = plantNeighborhoods(siteData, PlantIndex(plants), args.radius_km, class_column)
+                stage.rows_out = len(neighborhoods)
+
+            plants_path = os.path.join(out_dir, f'{stem}_plant_neighborhoods.csv')
+            neighborhoods.to_csv(plants_path)
+            logger.info(f'{len(neighborhoods)} plant neighborhood rows --> {plants_path}')
+
+
+if __name__ == '__main__':
+    main()
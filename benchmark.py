@@ -0,0 +1,318 @@
+import pandas as pd
+import numpy as np
+import argparse
+from shapely.geometry import Point
+import subprocess
+import tempfile
+import platform
+import json
+import time
+import sys
+import os
+
+if __package__:
+    from . import sites, coal, wind, solar, cache, fixtures
+else:  # run as a script, or imported from the repository directory
+    import sites
+    import coal
+    import wind
+    import solar
+    import cache
+    import fixtures
+
+local_path = os.path.dirname(os.path.abspath(__file__))
+
+SUITES = ['coords', 'grid', 'coal', 'wind', 'solar']
+
+# CLI arguments
+parser = argparse.ArgumentParser(description='Benchmarks of site generation, coal costs and wind/solar resource '
+                                             'processing on synthetic inputs, with a result history to spot '
+                                             'regressions between versions')
+parser.add_argument('--suites', nargs='+', type=str, choices=SUITES, default=SUITES,
+                    help='Benchmarks to run, default all')
+parser.add_argument('--state_sets', nargs='+', type=str, default=['PA', 'PA,OH,NY'],
+                    help="coords: comma separated state sets to grid, e.g. 'PA' 'PA,OH,NY' 'CONTINENTAL'. "
+                         "Default: PA and PA,OH,NY")
+parser.add_argument('--resolutions', nargs='+', type=float, default=[.5, .25, .1],
+                    help='coords and grid: lat/lon resolutions (in degrees) to time. Default: .5 .25 .1')
+parser.add_argument('--skip_legacy_below', type=float, default=.05,
+                    help='coords: resolutions finer than this only time the vectorized path (legacy is too slow). '
+                         'Default: .05')
+parser.add_argument('--scales', nargs='+', type=int, default=[1, 10, 100],
+                    help='coal: synthetic EIA-923 tables at these multiples of the real row counts. Default: 1 10 100')
+parser.add_argument('--coal_year', type=int, default=2020, help='coal: EIA-923 year the fixtures copy, default 2020')
+parser.add_argument('--chunksize', type=int, default=100000,
+                    help='coal: rows per chunk of the chunked EIA-923 loads, default 100000')
+parser.add_argument('--sites', nargs='+', type=int, default=[100],
+                    help='wind and solar: site counts served by the local stub API. Default: 100')
+parser.add_argument('--latency', type=float, default=0.0,
+                    help='wind and solar: seconds the stub API waits per response, default 0')
+parser.add_argument('--workers', type=int, default=4, help='wind and solar: concurrent downloads, default 4')
+parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the fastest is reported. Default: 3')
+parser.add_argument('--history', type=str, default=os.path.join(local_path, 'benchmark_results/history.jsonl'),
+                    help='JSON lines file the results are appended to, default benchmark_results/history.jsonl')
+parser.add_argument('--threshold', type=float, default=1.25,
+                    help='Flag cases slower than this ratio to the previous recorded run, default 1.25')
+parser.add_argument('--no_save', action='store_true', help='Compare with the history without appending to it')
+
+
+def legacyStateCoords(statesShp, deg_resolution):
+    """ Pre-vectorization getCoords() state path: one shapely contains() call per lattice point """
+
+    coordinates = []
+
+    bounds = statesShp.total_bounds
+
+    min_lon = round(bounds[0], 2)
+    min_lat = round(bounds[1], 2)
+    max_lon = round(bounds[2], 2)
+    max_lat = round(bounds[3], 2)
+
+    lat = min_lat
+
+    while lat <= max_lat:
+        lon = min_lon
+        while lon <= max_lon:
+            if statesShp.contains(Point(lon, lat)).any():
+                coordinates.append((lat, lon))
+            lon += deg_resolution
+        lat += deg_resolution
+
+    return coordinates
+
+
+def timeIt(function, repeat=1):
+    """ Fastest wall time (s) of repeat calls, and the last result """
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+
+def timeCoords(states, deg_resolution, legacy=True, repeat=1):
+    """ Time both coordinate generators at one resolution and check they return the same coordinate set, once the
+    legacy loop's accumulated float noise is rounded away """
+
+    statesShp = sites.loadStates(states)
+
+    vectorized, coords = timeIt(lambda: sites.coordList(sites.stateCoords(states, deg_resolution)), repeat)
+
+    row = {'deg_resolution': deg_resolution, 'sites': len(coords), 'vectorized_s': vectorized,
+           'legacy_s': None, 'speedup': None, 'identical': None}
+
+    if legacy:
+        start = time.perf_counter()
+        expected = legacyStateCoords(statesShp, deg_resolution)
+        row['legacy_s'] = time.perf_counter() - start
+        row['speedup'] = row['legacy_s'] / vectorized
+        row['identical'] = coords == [cache.siteKey(lat, lon) for lat, lon in expected]
+
+    return row
+
+
+def result(suite, case, params, n, seconds, **extra):
+    return {'suite': suite, 'case': case, 'params': params, 'n': n, 'seconds': seconds, **extra}
+
+
+def benchCoords(args):
+    """ getCoords() state path: vectorized (with the state index when it is built) vs the legacy loop """
+
+    if not os.path.exists(sites.STATES_SHP) and not os.path.exists(sites.STATE_INDEX):
+        print(f'coords: skipped, neither {sites.STATES_SHP} nor the state index exist')
+        return []
+
+    rows = []
+    for state_set in args.state_sets:
+        states = state_set.split(',')
+        for res in args.resolutions:
+            row = timeCoords(states, res, legacy=res >= args.skip_legacy_below, repeat=args.repeat)
+            params = f'{state_set} @ {res:g}'
+            rows.append(result('coords', 'stateCoords', params, row['sites'], row['vectorized_s'],
+                               identical=row['identical']))
+            if row['legacy_s'] is not None:
+                rows.append(result('coords', 'legacy', params, row['sites'], row['legacy_s']))
+
+    return rows
+
+
+def benchGrid(args):
+    """ getCoords() grid path over the continental US bounds """
+
+    rows = []
+    for res in args.resolutions:
+        grid = argparse.Namespace(geometry='grid', min_lat=24.5, max_lat=49.5, min_lon=-125.0, max_lon=-67.0,
+                                  deg_resolution=res)
+        seconds, coords = timeIt(lambda: sites.getCoords(grid), args.repeat)
+        rows.append(result('grid', 'getCoords', f'CONUS @ {res:g}', len(coords), seconds))
+
+    return rows
+
+
+def benchCoal(args):
+    """ EIA-923 loading and coal cost tables on synthetic tables at several multiples of the real row counts """
+
+    year = args.coal_year
+    rows = []
+
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory() as data_dir:
+            # Loads are counted in EIA-923 file rows
+            n = fixtures.writeEIA923(year, scale, data_dir)
+            params = f'{scale}x'
+
+            seconds, gen_fuel = timeIt(lambda: coal.loadGenFuel(year, data_dir), args.repeat)
+            rows.append(result('coal', 'loadGenFuel', params, n[f'EIA923GenFuel{year}.csv'], seconds))
+
+            seconds, fcl = timeIt(lambda: coal.loadFuelCosts(year, data_dir), args.repeat)
+            rows.append(result('coal', 'loadFuelCosts', params, n[f'EIA923FuelCosts{year}.csv'], seconds))
+
+            for name, load, page in (('loadGenFuel', coal.loadGenFuel, 'GenFuel'),
+                                     ('loadFuelCosts', coal.loadFuelCosts, 'FuelCosts')):
+                seconds, _ = timeIt(lambda: load(year, data_dir, chunksize=args.chunksize), args.repeat)
+                rows.append(result('coal', f'{name} (chunked)', params, n[f'EIA923{page}{year}.csv'], seconds))
+
+                if coal.pyarrow is not None:
+                    load(year, data_dir, parquet=True)  # writes the Parquet copy
+                    seconds, _ = timeIt(lambda: load(year, data_dir, parquet=True), args.repeat)
+                    rows.append(result('coal', f'{name} (parquet)', params, n[f'EIA923{page}{year}.csv'], seconds))
+
+            seconds, cpl = timeIt(lambda: coal.getPlantList(year, gen_fuel), args.repeat)
+            rows.append(result('coal', 'getPlantList', params, len(cpl), seconds))
+
+            for case, function in (('getRegCoalCosts', coal.getRegCoalCosts),
+                                   ('getUnrCoalCosts', coal.getUnrCoalCosts)):
+                seconds, costs = timeIt(lambda: function(year, cpl, fcl), args.repeat)
+                rows.append(result('coal', case, params, len(costs), seconds))
+
+            monthly_gen_fuel = coal.loadGenFuel(year, data_dir, monthly=True)
+            seconds, monthly = timeIt(lambda: coal.getMonthlyCoalCosts(year, monthly_gen_fuel, fcl), args.repeat)
+            rows.append(result('coal', 'getMonthlyCoalCosts', params, len(monthly), seconds))
+
+            seconds, tables = timeIt(lambda: coal.computeCostTables(year, data_dir), args.repeat)
+            rows.append(result('coal', 'computeCostTables', params, len(tables['coal_costs_total']), seconds))
+
+    return rows
+
+
+def stubCoords(n):
+    """ n distinct (lat, lon) sites on a .04 degree lattice """
+
+    side = int(np.ceil(np.sqrt(n)))
+    lat, lon = np.meshgrid(40 + .04 * np.arange(side), -80 + .04 * np.arange(side), indexing='ij')
+
+    return list(zip(lat.ravel().round(2).tolist(), lon.ravel().round(2).tolist()))[:n]
+
+
+def benchResource(args, tech):
+    """ Download into an empty resource cache, then the per-site and siteCosts() paths on the warm cache, all served
+    by the local stub API """
+
+    module, year = (wind, 2012) if tech == 'wind' else (solar, 2020)
+    download, getData = ((wind.downloadWindData, wind.getWindData) if tech == 'wind' else
+                         (solar.downloadSolarData, solar.getSolarData))
+    rows = []
+
+    saved = wind.WTK_URL, solar.NSRDB_URL, cache.cache_root
+    with fixtures.StubServer(args.latency) as stub, tempfile.TemporaryDirectory() as root:
+        wind.WTK_URL, solar.NSRDB_URL = stub.wtk_url, stub.nsrdb_url
+        try:
+            for n in args.sites:
+                coords = stubCoords(n)
+                params = f'{n} sites'
+
+                # Every cold run starts from its own empty cache
+                runs = iter(range(args.repeat))
+
+                def cold():
+                    cache.cache_root = os.path.join(root, f'{n}_{next(runs)}')
+                    return download(year, coords, 'benchmark', 'benchmark@example.com', args.workers, rate=1e6)
+
+                seconds, _ = timeIt(cold, args.repeat)
+                rows.append(result(tech, 'download (cold cache)', params, n, seconds))
+
+                seconds, _ = timeIt(lambda: [getData(year, lat, lon) for lat, lon in coords], args.repeat)
+                rows.append(result(tech, f'{getData.__name__} (warm cache)', params, n, seconds))
+
+                seconds, _ = timeIt(lambda: module.siteCosts(coords, year, 'benchmark', 'benchmark@example.com',
+                                                             args.workers, rate=1e6), args.repeat)
+                rows.append(result(tech, 'siteCosts (warm cache)', params, n, seconds))
+        finally:
+            wind.WTK_URL, solar.NSRDB_URL, cache.cache_root = saved
+
+    return rows
+
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=local_path, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def readHistory(path):
+    if not os.path.exists(path):
+        return []
+
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(results, history, threshold):
+    """ Add each case's time in the most recent earlier run that has it, and flag slowdowns beyond threshold """
+
+    previous = {}
+    for run in history:
+        for row in run['results']:
+            previous[(row['suite'], row['case'], row['params'])] = row['seconds']
+
+    results = results.copy()
+    results['previous_s'] = [previous.get(key, np.nan)
+                             for key in zip(results['suite'], results['case'], results['params'])]
+    results['ratio'] = results['seconds'] / results['previous_s']
+    results['regression'] = results['ratio'] > threshold
+
+    return results
+
+
+def main():
+    args = parser.parse_args()
+
+    benches = {'coords': benchCoords, 'grid': benchGrid, 'coal': benchCoal,
+               'wind': lambda a: benchResource(a, 'wind'), 'solar': lambda a: benchResource(a, 'solar')}
+
+    rows = []
+    for suite in args.suites:
+        rows += benches[suite](args)
+
+    if not rows:
+        sys.exit('Nothing to benchmark')
+
+    results = compare(pd.DataFrame(rows), readHistory(args.history), args.threshold)
+
+    print(results.to_string(index=False))
+
+    if not args.no_save:
+        run = {'commit': gitCommit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'machine': {'platform': platform.platform(), 'processor': platform.processor(),
+                           'cpus': os.cpu_count(), 'python': platform.python_version()},
+               'results': rows}
+
+        os.makedirs(os.path.dirname(args.history), exist_ok=True)
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(run) + '\n')
+        print(f'Results appended to {args.history}')
+
+    regressions = results[results['regression']]
+    if len(regressions):
+        sys.exit(f'{len(regressions)} cases slower than {args.threshold}x the previous run: '
+                 f'{", ".join(regressions["suite"] + "/" + regressions["case"] + " " + regressions["params"])}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+import pandas as pd
+import numpy as np
+from contextlib import contextmanager
+import argparse
+import json
+import csv
+import io
+import os
+import re
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run one process per cache
+    fcntl = None
+
+local_path = os.path.dirname(os.path.abspath(__file__))
+cache_root = os.path.join(local_path, 'resource_cache/')
+
+# Decimals of canonical site coordinates: float noise below this never splits one site into several cache entries
+COORD_DECIMALS = 6
+
+
+def siteKey(lat, lon):
+    """ Canonical (lat, lon) of a site: rounded to COORD_DECIMALS, as Python floats without negative zero. Every
+    cache and metadata index lookup goes through it """
+    return float(round(lat, COORD_DECIMALS)) + 0.0, float(round(lon, COORD_DECIMALS)) + 0.0
+
+
+def _open(source):
+    """ Downloaded bytes or a file path --> binary file object """
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return open(source, 'rb')
+
+
+@contextmanager
+def fileLock(path):
+    """ Exclusive lock on path (created if needed) across processes, for caches shared by several shard workers """
+
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _typed(value):
+    """ Header metadata strings --> int/float where possible, so they round-trip into the output CSVs unchanged """
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+def readMeta(source):
+    """ Header-only read: first two rows of an NREL resource CSV (field names, values) --> dict. The time series
+    below the header is never read """
+
+    with _open(source) as f:
+        head = [f.readline().decode('utf-8-sig') for _ in range(2)]
+
+    names, values = csv.reader(head)
+
+    return {name: _typed(value) for name, value in zip(names, values)
+            if name and not name.startswith('Unnamed')}
+
+
+def _readSeries(source, skiprows):
+    """ Resource time series --> float32 DataFrame (padding columns from pandas-rewritten files are dropped) """
+
+    with _open(source) as f:
+        frame = pd.read_csv(f, skiprows=skiprows, dtype=np.float32)
+
+    return frame.loc[:, ~frame.columns.str.startswith('Unnamed')]
+
+
+def readSRW(source):
+    """ WIND Toolkit SRW file: 2 metadata rows, column header, units row, hub-height row, then hourly data """
+    return readMeta(source), _readSeries(source, [0, 1, 3, 4])
+
+
+def readPSM3(source):
+    """ NSRDB PSM v3 file: 2 metadata rows, column header, then hourly data """
+    return readMeta(source), _readSeries(source, [0, 1])
+
+
+# dataset prefix --> (file reader, suffix of the legacy per-coordinate CSV files)
+FORMATS = {'wtk': (readSRW, '_wtk.csv'),
+           'nsrdb': (readPSM3, '_nsrdb.csv')}
+
+
+class ResourceCache:
+    """ Hourly resource data for one dataset and year, keyed by canonical (lat, lon) (see siteKey()).
+
+    Every site is one fixed-size row of float32 values (columns x hours) appended to data.f32, with its key in
+    keys.f64 and header metadata in meta.jsonl. The key index is built once when the cache is opened, after
+    which lookups are a dict hit plus a single seek -- no text parsing. Rows left incomplete by an interrupted
+    run are trimmed on open. Writes hold a lock file, so several processes can share one cache. """
+
+    def __init__(self, dataset, year, root=cache_root):
+        self.dataset = dataset
+        self.year = year
+        self.path = os.path.join(root, dataset, str(year))
+        os.makedirs(self.path, exist_ok=True)
+
+        self.columns = None
+        self.length = None
+        self.rows = {}
+        self._meta = {}
+
+        with fileLock(self._file('.lock')):
+            self._layout()
+
+    def _layout(self):
+        layout_path = self._file('layout.json')
+        if os.path.exists(layout_path):
+            with open(layout_path) as f:
+                layout = json.load(f)
+            self.columns = layout['columns']
+            self.length = layout['length']
+            self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _rowBytes(self):
+        return len(self.columns) * self.length * 4
+
+    def _load(self):
+        keys = np.fromfile(self._file('keys.f64'), dtype=np.float64) if os.path.exists(self._file('keys.f64')) \
+            else np.empty(0)
+        keys = keys[:len(keys) // 2 * 2].reshape(-1, 2)
+
+        data_rows = os.path.getsize(self._file('data.f32')) // self._rowBytes() \
+            if os.path.exists(self._file('data.f32')) else 0
+
+        # Byte offset after each complete metadata line, so a partly written last line can be cut off too
+        meta, ends = [], [0]
+        if os.path.exists(self._file('meta.jsonl')):
+            with open(self._file('meta.jsonl'), 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        meta.append(json.loads(line))
+                    except ValueError:  # a line appended onto a partial one before partial lines were trimmed
+                        break
+                    ends.append(ends[-1] + len(line))
+
+        # Keep only rows that were completely written
+        n = min(len(keys), data_rows, len(meta))
+        self._truncate(n, ends[n])
+
+        self.rows = {siteKey(lat, lon): i for i, (lat, lon) in enumerate(keys[:n].tolist())}
+        self._meta = dict(enumerate(meta[:n]))
+
+    def _truncate(self, n, meta_bytes):
+        for name, size in (('keys.f64', n * 16), ('data.f32', n * self._rowBytes()), ('meta.jsonl', meta_bytes)):
+            if os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) > size:
+                with open(self._file(name), 'r+b') as f:
+                    f.truncate(size)
+
+    def refresh(self):
+        """ Pick up sites added by other processes since the cache was opened """
+
+        keys_path = self._file('keys.f64')
+        if os.path.exists(keys_path) and os.path.getsize(keys_path) == len(self.rows) * 16:
+            return
+
+        with fileLock(self._file('.lock')):
+            self._layout()
+
+    def __contains__(self, key):
+        return siteKey(*key) in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def put(self, lat, lon, frame, meta=None):
+        """ Append one site's time series (DataFrame of float columns) and header metadata """
+
+        lat, lon = siteKey(lat, lon)
+
+        with fileLock(self._file('.lock')):
+            if self.columns is None:
+                # Another process may have created the cache since it was opened here
+                self._layout()
+
+            if self.columns is None:
+                self.columns = list(frame.columns)
+                self.length = len(frame)
+                with open(self._file('layout.json'), 'w') as f:
+                    json.dump({'dataset': self.dataset, 'year': self.year, 'columns': self.columns,
+                               'length': self.length}, f)
+
+            if list(frame.columns) != self.columns or len(frame) != self.length:
+                raise ValueError(f'{self.dataset} {self.year} data for ({lat}, {lon}) does not match the cache layout: '
+                                 f'{len(frame)} x {list(frame.columns)}, expected {self.length} x {self.columns}')
+
+            values = np.ascontiguousarray(frame.to_numpy(dtype=np.float32).T)
+
+            # Row number from the file itself, as other processes may have appended rows
+            row = os.path.getsize(self._file('data.f32')) // self._rowBytes() \
+                if os.path.exists(self._file('data.f32')) else 0
+
+            with open(self._file('data.f32'), 'ab') as f:
+                f.write(values.tobytes())
+            with open(self._file('meta.jsonl'), 'a') as f:
+                f.write(json.dumps(meta or {}) + '\n')
+            with open(self._file('keys.f64'), 'ab') as f:
+                f.write(np.array([lat, lon], dtype=np.float64).tobytes())
+
+        self.rows[(lat, lon)] = row
+        self._meta[row] = meta or {}
+
+    def matrix(self, coords, columns):
+        """ Several sites' hourly values as one float32 array (sites x columns x hours), gathered from a memory map
+        of the data file without reading the other sites """
+
+        rows = np.array([self.rows[siteKey(lat, lon)] for lat, lon in coords], dtype=np.int64)
+        idx = np.array([self.columns.index(column) for column in columns])
+
+        data = np.memmap(self._file('data.f32'), dtype=np.float32, mode='r',
+                         shape=(os.path.getsize(self._file('data.f32')) // self._rowBytes(), len(self.columns),
+                                self.length))
+
+        return np.asarray(data[rows[:, None], idx])
+
+    def meta(self, lat, lon):
+        """ One site's header metadata (e.g. NSRDB Latitude/Longitude/Elevation) """
+        return self._meta[self.rows[siteKey(lat, lon)]]
+
+
+class MetaIndex:
+    """ Persistent (canonical lat, lon, year) --> header fields (e.g. NSRDB grid cell and elevation) for one dataset.
+
+    Kept next to the per-year caches in a small CSV that is read once per run, so runs that only need site metadata
+    never open the time series. """
+
+    def __init__(self, dataset, fields, root=cache_root):
+        self.path = os.path.join(root, dataset, 'meta_index.csv')
+        self.fields = fields
+        self.entries = {}
+
+        if os.path.exists(self.path):
+            # round_trip parsing, so the (lat, lon) keys come back bit-identical
+            index = pd.read_csv(self.path, float_precision='round_trip')
+            columns = [index[c].tolist() for c in ['lat', 'lon', 'year'] + fields]
+            for lat, lon, year, *values in zip(*columns):
+                self.entries[(*siteKey(lat, lon), year)] = tuple(values)
+
+    def get(self, lat, lon, year):
+        return self.entries.get((*siteKey(lat, lon), year))
+
+    def put(self, lat, lon, year, values):
+        lat, lon = siteKey(lat, lon)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        with fileLock(f'{self.path}.lock'):
+            if not os.path.exists(self.path):
+                with open(self.path, 'w', newline='') as f:
+                    csv.writer(f).writerow(['lat', 'lon', 'year'] + self.fields)
+
+            with open(self.path, 'a', newline='') as f:
+                csv.writer(f).writerow([repr(lat), repr(lon), year] + list(values))
+
+        self.entries[(lat, lon, year)] = tuple(values)
+
+
+_open_caches = {}
+
+
+def openCache(dataset, year, root=None):
+    """ Shared ResourceCache per (dataset, year), so the key index is only built once per process. root defaults to
+    the module's cache_root at call time, so benchmarks can point every pipeline at a scratch cache """
+
+    root = root or cache_root
+    key = (root, dataset, year)
+    if key not in _open_caches:
+        _open_caches[key] = ResourceCache(dataset, year, root)
+
+    return _open_caches[key]
+
+
+_open_indexes = {}
+
+
+def openMetaIndex(dataset, fields, root=None):
+    """ Shared MetaIndex per dataset """
+
+    root = root or cache_root
+    key = (root, dataset)
+    if key not in _open_indexes:
+        _open_indexes[key] = MetaIndex(dataset, fields, root)
+
+    return _open_indexes[key]
+
+
+def importCSVs(dataset, year, source_dir, remove=False, root=None):
+    """ One-time import of legacy {lat}_{lon}_wtk.csv / {lat}_{lon}_nsrdb.csv files into the cache """
+
+    reader, suffix = FORMATS[dataset.split('_')[0]]
+    pattern = re.compile(rf'^(.+)_(.+){re.escape(suffix)}$')
+    store = openCache(dataset, year, root)
+
+    imported = 0
+    for name in sorted(os.listdir(source_dir)):
+        match = pattern.match(name)
+        if match is None:
+            continue
+
+        lat, lon = float(match.group(1)), float(match.group(2))
+        path = os.path.join(source_dir, name)
+
+        if (lat, lon) not in store:
+            meta, frame = reader(path)
+            store.put(lat, lon, frame, meta)
+            imported += 1
+
+        if remove:
+            os.remove(path)
+
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import per-coordinate resource CSV files into the resource cache')
+    parser.add_argument('--dataset', type=str, required=True, choices=['wtk_100m', 'nsrdb'],
+                        help="'wtk_100m' for wind_data_output/*_wtk.csv, 'nsrdb' for solar_data_output/*_nsrdb.csv")
+    parser.add_argument('--year', type=int, required=True,
+                        help='Data year the CSV files were downloaded for (not recorded in the file names)')
+    parser.add_argument('--source_dir', type=str, required=True, help='Directory holding the CSV files')
+    parser.add_argument('--remove', action='store_true', help='Delete each CSV file once it is in the cache')
+    args = parser.parse_args()
+
+    imported = importCSVs(args.dataset, args.year, args.source_dir, args.remove)
+    print(f'Imported {imported} sites into {openCache(args.dataset, args.year).path}')
+
+
+if __name__ == '__main__':
+    main()
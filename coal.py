@@ -1,45 +1,224 @@
 import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 import argparse
+import sys
 import os
 
+if __package__:
+    from . import manifest, instrument
+    from .instrument import logger
+else:  # run as a script, or imported from the repository directory
+    import manifest
+    import instrument
+    from instrument import logger
+
+try:
+    import pyarrow  # noqa: F401  (--parquet)
+except ImportError:
+    pyarrow = None
+
 local_path = os.path.dirname(os.path.abspath(__file__))
+coal_data = os.path.join(local_path, 'coal_plant_data/')
 coal_output = os.path.join(local_path, 'coal_data_output/')
 
+DATA_YEARS = [2015, 2016, 2017, 2018, 2019, 2020]
+
+# Cost parameters adapted from Lazard LCOE Analysis v14.0 and NREL ATB 2021 (scenarios.py sweeps them)
+VOM = 4.35  # $/MWh
+FOPEX = 31.75 * (10**3)  # $/MW-yr, assumed static in subsequent years
+UNR_FUEL_COST = 1.925  # $/MMBTU, estimated fuel cost of unregulated plants --> see Supplementary Material
+
+
+def yearRange(value):
+    """ '--data_years' value: 'all', a range like '2015-2020', or a comma separated list like '2016,2018' """
+
+    if value == 'all':
+        return DATA_YEARS
+
+    try:
+        if '-' in value:
+            first, last = (int(v) for v in value.split('-'))
+            years = list(range(first, last + 1))
+        else:
+            years = [int(v) for v in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid year range '{value}'")
+
+    if not years or any(y not in DATA_YEARS for y in years):
+        raise argparse.ArgumentTypeError(f"years must be in {DATA_YEARS[0]}-{DATA_YEARS[-1]} (inclusive), "
+                                         f"got '{value}'")
+
+    return years
+
+
 # CLI arguments
 parser = argparse.ArgumentParser(description='Command line arguments for data extraction and cost calculations')
-parser.add_argument('--data_year', type=int, choices=[2015, 2016, 2017, 2018, 2019, 2020], required=True,
-                    help='Year for data extraction. Must be in 2015-2020 (inclusive).')
-args = parser.parse_args()
+year_args = parser.add_mutually_exclusive_group(required=True)
+year_args.add_argument('--data_year', type=int, choices=DATA_YEARS,
+                       help='Year for data extraction. Must be in 2015-2020 (inclusive).')
+year_args.add_argument('--data_years', type=yearRange,
+                       help="Batch of years processed in parallel, e.g. '2015-2020', '2016,2018' or 'all'.")
+parser.add_argument('--workers', type=int, default=None,
+                    help='Worker processes for --data_years, default one per CPU')
+parser.add_argument('--monthly', action='store_true',
+                    help='Also write CoalCostsMonthly{year}.csv: heat rate, fuel cost and VOPEX by plant, prime mover '
+                         'and month')
+parser.add_argument('--incremental', action='store_true',
+                    help='Skip years whose EIA-923 inputs, code and outputs are unchanged since the last run')
+parser.add_argument('--chunksize', type=int, default=None,
+                    help='Read the EIA-923 files this many rows at a time, keeping only coal rows, so memory stays '
+                         'bounded for large releases. Default: whole files')
+parser.add_argument('--parquet', action='store_true',
+                    help="Keep a typed Parquet copy of each EIA-923 file's coal rows next to it, read instead of the "
+                         "CSV until the CSV changes (needs pyarrow)")
+instrument.addArguments(parser)
 
 
-def getPlantList():
-    """ Function to return relevant EIA-923 page 1 coal plant data for use in decarb + equity optimization model """
+# EIA-923 page 1 columns used by the cost calculations --> short names, with compact dtypes for the raw read
+GEN_FUEL_COLUMNS = {'Plant Id': 'ORIS_ID', 'Combined Heat And\nPower Plant': 'Combined_Heat',
+                    'Plant Name': 'Plant_Name', 'Plant State': 'State', 'EIA Sector Number': 'EIA_Sector',
+                    'AER\nFuel Type Code': 'Fuel_Type', 'Total Fuel Consumption\nMMBtu': 'FuelCon_MMBTU',
+                    'Net Generation\n(Megawatthours)': 'Gen_MWh'}
+GEN_FUEL_DTYPES = {'Plant Id': 'int32', 'Combined Heat And\nPower Plant': 'category', 'Plant Name': 'category',
+                   'Plant State': 'category', 'EIA Sector Number': 'int8', 'AER\nFuel Type Code': 'category',
+                   'Total Fuel Consumption\nMMBtu': 'int64', 'Net Generation\n(Megawatthours)': 'float64'}
 
-    year = args.data_year
-    # Import Comprehensive Power Plant List From EIA-923 Page 1
-    file_path = os.path.join(local_path, f'coal_plant_data/EIA923GenFuel{year}.csv')
-    cpl = pd.read_csv(file_path)
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+          'November', 'December']
 
-    # Subset coal plants by AER code
-    cpl = cpl[
-        ['Plant Id', 'Combined Heat And\nPower Plant', 'Plant Name', 'Plant State', 'EIA Sector Number',
-         'AER\nFuel Type Code', 'Total Fuel Consumption\nMMBtu', 'Net Generation\n(Megawatthours)']]
-    cpl.rename(
-        columns={'Plant Id': 'ORIS_ID', 'Combined Heat And\nPower Plant': 'Combined_Heat', 'Plant Name': 'Plant_Name',
-                 'Plant State': 'State', 'EIA Sector Number': 'EIA_Sector', 'AER\nFuel Type Code': 'Fuel_Type',
-                 'Total Fuel Consumption\nMMBtu': 'FuelCon_MMBTU',
-                 'Net Generation\n(Megawatthours)': 'Gen_MWh'}, inplace=True)
+# EIA-923 page 1 columns added for monthly costs: prime mover, and fuel consumption and net generation by month
+MONTHLY_GEN_FUEL_COLUMNS = {'Reported\nPrime Mover': 'Prime_Mover',
+                            **{f'Tot_MMBtu\n{month}': f'FuelCon_MMBTU_{i}' for i, month in enumerate(MONTHS, 1)},
+                            **{f'Netgen\n{month}': f'Gen_MWh_{i}' for i, month in enumerate(MONTHS, 1)}}
 
-    cpl = cpl[cpl['Fuel_Type'].str.contains('COL|WOC')]
+# EIA-923 page 5 columns used by the cost calculations
+FUEL_COST_COLUMNS = {'Plant Id': 'ORIS_ID', 'MONTH': 'MONTH', 'FUEL_GROUP': 'FUEL_GROUP', 'Regulated': 'Regulated',
+                     'QUANTITY': 'QUANTITY', 'Average Heat\nContent': 'Avg_Heat_Content', 'FUEL_COST': 'FUEL_COST'}
+FUEL_COST_DTYPES = {'Plant Id': 'int32', 'MONTH': 'int8', 'FUEL_GROUP': 'category', 'Regulated': 'category',
+                    'QUANTITY': 'float64', 'Average Heat\nContent': 'float64', 'FUEL_COST': 'float64'}
 
-    # Filter out any potential non-operational plants
-    cpl = cpl[cpl.FuelCon_MMBTU != 0]
-    cpl = cpl[cpl.Gen_MWh > 0]
 
-    # Filter out co-gen plants
-    cpl = cpl[cpl['ORIS_ID'] != 99999]  # 999999 == state level fuel increment
-    cpl = cpl[(cpl.EIA_Sector != 3) & (cpl.EIA_Sector != 7)]
-    cpl = cpl[cpl['Combined_Heat'] == 'N']
+def normalizeHeader(name):
+    """ EIA-923 column header --> lower case with single spaces, e.g. 'AER\nFuel Type Code' --> 'aer fuel type code'.
+    Releases differ in line breaks and spacing of the quoted headers """
+    return ' '.join(str(name).lstrip('\ufeff').split()).lower()
+
+
+def headerColumns(file_path, columns):
+    """ Header of file_path --> the columns key each wanted column matches by normalized name """
+
+    header = {normalizeHeader(column): column for column in pd.read_csv(file_path, nrows=0).columns}
+
+    missing = [column for column in columns if normalizeHeader(column) not in header]
+    if missing:
+        raise ValueError(f'{file_path}: no {missing} columns')
+
+    return {header[normalizeHeader(column)]: column for column in columns}
+
+
+def readEIA923(file_path, columns, dtypes, keep, na_values=None, chunksize=None):
+    """ Rows of an EIA-923 CSV for which keep(frame) is True, with the columns (header --> short name) and dtypes
+    (by header); '.' is missing in the na_values columns. With chunksize (rows) the file is read and filtered one
+    chunk at a time, so memory is bounded by one chunk plus the rows kept """
+
+    source = headerColumns(file_path, columns)
+    options = {'usecols': list(source), 'dtype': {header: dtypes[column] for header, column in source.items()},
+               'na_values': {header: '.' for header, column in source.items() if column in (na_values or [])}}
+
+    def select(frame):
+        frame = frame[list(source)].set_axis(list(columns.values()), axis=1)
+        return frame[keep(frame)]
+
+    if chunksize is None:
+        frame = select(pd.read_csv(file_path, **options))
+    else:
+        with pd.read_csv(file_path, chunksize=chunksize, **options) as reader:
+            parts = [select(chunk) for chunk in reader]
+        # Chunks have their own categories: the kept rows are re-encoded once
+        frame = pd.concat(parts, ignore_index=True) if parts else select(pd.read_csv(file_path, nrows=0, **options))
+
+    categories = [columns[column] for column in source.values() if dtypes[column] == 'category']
+    frame = frame.astype({column: 'category' for column in categories})
+    for column in categories:
+        frame[column] = frame[column].cat.remove_unused_categories()
+
+    return frame.reset_index(drop=True)
+
+
+def parquetCopy(file_path, read, columns=None):
+    """ Typed Parquet copy of the frame read() loads from an EIA-923 CSV, stored next to the CSV: written on the first
+    call, then read instead of the CSV (only columns, if given) while the CSV size and modification time are those
+    recorded in the copy """
+
+    parquet_path = f'{os.path.splitext(file_path)[0]}.parquet'
+    source = f'{os.stat(file_path).st_size}:{os.stat(file_path).st_mtime_ns}'
+
+    if os.path.exists(parquet_path):
+        frame = pd.read_parquet(parquet_path, columns=columns)
+        if frame.attrs.get('source') == source:
+            return frame
+
+    frame = read()
+    frame.attrs['source'] = source
+
+    part = f'{parquet_path}.part'
+    frame.to_parquet(part, index=False)
+    os.replace(part, parquet_path)
+
+    return frame if columns is None else frame[columns]
+
+
+def coalRows(gen_fuel):
+    """ EIA-923 page 1 rows of coal and waste coal generators (every other row is dropped when loading) """
+    return gen_fuel['Fuel_Type'].str.contains('COL|WOC', na=False)
+
+
+def loadGenFuel(year, data_dir=None, monthly=False, chunksize=None, parquet=False):
+    """ Read the coal rows of EIA-923 page 1 (generation and fuel consumption) once, keeping only the columns used
+    downstream. monthly=True adds the prime mover and the monthly fuel consumption and net generation columns.
+    chunksize and parquet: see readEIA923() and parquetCopy() """
+
+    file_path = os.path.join(data_dir or coal_data, f'EIA923GenFuel{year}.csv')
+
+    def read(monthly):
+        columns = {**GEN_FUEL_COLUMNS, **MONTHLY_GEN_FUEL_COLUMNS} if monthly else GEN_FUEL_COLUMNS
+        dtypes = {column: GEN_FUEL_DTYPES.get(column, 'float64') for column in columns}
+        dtypes['Reported\nPrime Mover'] = 'category'
+
+        # Missing monthly values are reported as '.'
+        return readEIA923(file_path, columns, dtypes, coalRows, MONTHLY_GEN_FUEL_COLUMNS, chunksize)
+
+    if not parquet:
+        return read(monthly)
+
+    # One Parquet copy with the monthly columns serves both
+    columns = {**GEN_FUEL_COLUMNS, **MONTHLY_GEN_FUEL_COLUMNS} if monthly else GEN_FUEL_COLUMNS
+    return parquetCopy(file_path, lambda: read(True), list(columns.values()))
+
+
+def loadFuelCosts(year, data_dir=None, chunksize=None, parquet=False):
+    """ Read the coal receipts of EIA-923 page 5 (fuel receipts and costs) once, keeping only the columns used
+    downstream. chunksize and parquet: see readEIA923() and parquetCopy() """
+
+    file_path = os.path.join(data_dir or coal_data, f'EIA923FuelCosts{year}.csv')
+
+    def read():
+        # Withheld fuel costs are reported as '.'
+        return readEIA923(file_path, FUEL_COST_COLUMNS, FUEL_COST_DTYPES, lambda fcl: fcl['FUEL_GROUP'] == 'Coal',
+                          ['FUEL_COST'], chunksize)
+
+    return parquetCopy(file_path, read) if parquet else read()
+
+
+def getPlantList(year, cpl=None, data_dir=None):
+    """ Function to return relevant EIA-923 page 1 coal plant data for use in decarb + equity optimization model """
+
+    # Import Comprehensive Power Plant List From EIA-923 Page 1
+    if cpl is None:
+        cpl = loadGenFuel(year, data_dir)
+
+    cpl = coalGenerators(cpl)
 
     # Sum individual generator consumption, and and individual generator generation for plant totals
     cpl.loc[:, 'NetGen_MWh'] = cpl.groupby(['ORIS_ID'])['Gen_MWh'].transform('sum')
@@ -52,42 +231,44 @@ def getPlantList():
     del cpl['FuelCon_MMBTU']
     del cpl['Gen_MWh']
 
-    # Save and output file
-    cpl_output = os.path.join(coal_output, f'CoalPlantList{year}.csv')
-    cpl.to_csv(cpl_output, index=False)
+    return cpl
+
+
+def coalGenerators(cpl):
+    """ EIA-923 page 1 rows of operating, non-CHP coal generators """
+
+    # Subset coal plants by AER code
+    cpl = cpl[coalRows(cpl)]
+
+    # Filter out any potential non-operational plants
+    cpl = cpl[cpl.FuelCon_MMBTU != 0]
+    cpl = cpl[cpl.Gen_MWh > 0]
+
+    # Filter out co-gen plants
+    cpl = cpl[cpl['ORIS_ID'] != 99999]  # 999999 == state level fuel increment
+    cpl = cpl[(cpl.EIA_Sector != 3) & (cpl.EIA_Sector != 7)]
+    cpl = cpl[cpl['Combined_Heat'] == 'N']
 
     return cpl
 
 
 # Regulated Coal Plants
-def getRegCoalCosts():
+def getRegCoalCosts(year, cpl=None, fcl=None, data_dir=None):
     """ Function to calculate annual variable operation costs (VOPEX) for regulated coal plants as reported by EIA-923.
     Values after 2020 are projections provided by NREL ATB 2021 """
 
-    year = args.data_year
-
     # Load coal plant list for merge
-    cpl = getPlantList()
+    if cpl is None:
+        cpl = getPlantList(year, data_dir=data_dir)
 
     # Load fuel cost data for coal plants from EIA-923 page 5
-    file_path = os.path.join(local_path, f'coal_plant_data/EIA923FuelCosts{year}.csv')
-    fcl = pd.read_csv(file_path)
-
-    fcl = fcl[
-        ['YEAR', 'MONTH', 'Plant Id', 'Plant Name', 'FUEL_GROUP', 'Regulated', 'Average Heat\nContent', 'FUEL_COST']]
+    if fcl is None:
+        fcl = loadFuelCosts(year, data_dir)
 
-    fcl.rename(columns={'Plant Id': 'ORIS_ID', 'Average Heat\nContent': 'Avg_Heat_Content'}, inplace=True)
-
-    # Print average coal plant heat content, and filter out unregulated coal plants
+    # Filter out unregulated coal plants
     fcl = fcl[fcl['FUEL_GROUP'] == 'Coal']
-    print("Average heat content for all coal plants (2020): ", fcl['Avg_Heat_Content'].mean(), ' MMBTU/Short-ton')
-
     fcl = fcl[fcl['Regulated'] == 'REG']
 
-    # Clean
-    del fcl['Avg_Heat_Content']
-    fcl = fcl.astype({'FUEL_COST': float})
-
     fcl_reg = fcl.groupby('ORIS_ID')["FUEL_COST"].mean().rename("Avg_Fuel_Cost_($/MMBTU)").reset_index()
     fcl_reg['Avg_Fuel_Cost_($/MMBTU)'] = fcl_reg['Avg_Fuel_Cost_($/MMBTU)'] / 100  # for units of $/MMBTU
 
@@ -100,41 +281,30 @@ def getRegCoalCosts():
                                                          * coalCostsReg['Avg_Fuel_Cost_($/MMBTU)'])
 
     # Parameter values adapted from Lazard LCOE Analysis v14.0 and NREL ATB 2021
-    coalCostsReg.loc[:, 'VOM_($/MWh)'] = 4.35
+    coalCostsReg.loc[:, 'VOM_($/MWh)'] = VOM
     coalCostsReg.loc[:, 'Coal_VOPEX_($/MWh)'] = coalCostsReg['Marginal_Fuel_Cost_($/MWh)'] + coalCostsReg['VOM_($/MWh)']
-    coalCostsReg.loc[:, 'Coal_FOPEX_($/MW)'] = 31.75 * (10**3)  # $/MW-yr, assumed static in subsequent years
-
-    # Local file output
-    reg_output = os.path.join(coal_output, f'CoalCostsReg{year}.csv')
-    coalCostsReg.to_csv(reg_output, index=False)
+    coalCostsReg.loc[:, 'Coal_FOPEX_($/MW)'] = FOPEX  # $/MW-yr, assumed static in subsequent years
 
     return coalCostsReg
 
 
 # Unregulated Coal Plants
-def getUnrCoalCosts():
+def getUnrCoalCosts(year, cpl=None, fcl=None, data_dir=None):
     """ Function to estimate annual variable operation costs for unregulated coal plants """
 
-    year = args.data_year
     # Load coal plant list for merge
-    cpl = getPlantList()
+    if cpl is None:
+        cpl = getPlantList(year, data_dir=data_dir)
 
     # Load fuel cost data for coal plants from EIA-923 page 5
-    file_path = os.path.join(local_path, f'coal_plant_data/EIA923FuelCosts{year}.csv')
-    fcl = pd.read_csv(file_path)
-
-    fcl = fcl[
-        ['YEAR', 'MONTH', 'Plant Id', 'Plant Name', 'FUEL_GROUP', 'Regulated', 'Average Heat\nContent']]
-    fcl.rename(columns={'Plant Id': 'ORIS_ID', 'Average Heat\nContent': 'Avg_Heat_Content'}, inplace=True)
+    if fcl is None:
+        fcl = loadFuelCosts(year, data_dir)
 
     # Filter out regulated coal plants
     fcl = fcl[fcl['FUEL_GROUP'] == 'Coal']
     fcl = fcl[fcl['Regulated'] == 'UNR']
 
-    # Check average heat content of unregulated coal plants specifically
-    print("Average heat content of UNR coal plants: ", fcl['Avg_Heat_Content'].mean(), ' MMBTU/Short-ton')
-
-    fcl.loc[:, 'Fuel_Cost'] = 1.925  # $/MMBTU --> see Supplementary Material
+    fcl.loc[:, 'Fuel_Cost'] = UNR_FUEL_COST  # $/MMBTU --> see Supplementary Material
 
     # Actually an estimated fuel cost, but referred to as "Avg_Fuel_Cost" for dataframe merging
     fcl = fcl.astype({'Fuel_Cost': float})
@@ -149,43 +319,305 @@ def getUnrCoalCosts():
                                                          * coalCostsUnr['Avg_Fuel_Cost_($/MMBTU)'])
 
     # Parameter values taken from Lazard and NREL ATB 2020
-    coalCostsUnr.loc[:, 'VOM_($/MWh)'] = 4.35
+    coalCostsUnr.loc[:, 'VOM_($/MWh)'] = VOM
     coalCostsUnr.loc[:, 'Coal_VOPEX_($/MWh)'] = coalCostsUnr['Marginal_Fuel_Cost_($/MWh)'] + coalCostsUnr['VOM_($/MWh)']
-    coalCostsUnr.loc[:, 'Coal_FOPEX_($/MW)'] = 31.75 * (10**3)  # $/MW-yr
-
-    # Local file output
-    unr_output = os.path.join(coal_output, f'CoalCostsUnr{year}.csv')
-    coalCostsUnr.to_csv(unr_output, index=False)
+    coalCostsUnr.loc[:, 'Coal_FOPEX_($/MW)'] = FOPEX  # $/MW-yr
 
     return coalCostsUnr
 
 
-def mergeCosts():
-    """ merges annual operation cost dataframes for regulated and unregulated coal plants  """
+# Monthly Coal Plant Costs
+def getMonthlyCoalCosts(year, gen_fuel=None, fcl=None, data_dir=None, prime_mover=True):
+    """ Heat rate, marginal fuel cost and VOPEX of regulated and unregulated coal plants by month and prime mover
+    (prime_mover=False: plant totals), indexed by (Regulated, ORIS_ID, Prime_Mover, MONTH). Months without net
+    generation are left out.
+
+    Regulated fuel costs are weighted by delivered heat content (QUANTITY x Average Heat Content) instead of a plain
+    mean over receipts; months without priced coal receipts use the plant's weighted annual cost """
+
+    # Load monthly coal generator data (EIA-923 page 1) and fuel cost data (page 5)
+    if gen_fuel is None:
+        gen_fuel = loadGenFuel(year, data_dir, monthly=True)
+
+    if fcl is None:
+        fcl = loadFuelCosts(year, data_dir)
+
+    keys = ['ORIS_ID', 'Prime_Mover'] if prime_mover else ['ORIS_ID']
+
+    # Generator rows x 12 months --> fuel consumption and generation per plant (and prime mover) and month
+    gen = coalGenerators(gen_fuel)
+    monthly = pd.DataFrame({**{key: gen[key].array.repeat(12) for key in keys},
+                            'MONTH': np.tile(np.arange(1, 13, dtype=np.int8), len(gen)),
+                            'FuelCon_MMBTU': gen[[f'FuelCon_MMBTU_{m}' for m in range(1, 13)]].to_numpy().ravel(),
+                            'Gen_MWh': gen[[f'Gen_MWh_{m}' for m in range(1, 13)]].to_numpy().ravel()})
+    monthly = monthly.groupby(keys + ['MONTH'], observed=True).sum(min_count=1).reset_index()
+    monthly = monthly[monthly['Gen_MWh'] > 0]
+
+    # Coal receipts --> delivered MMBTU and cost ($/MMBTU x MMBTU) of the priced receipts per plant and month
+    fcl = fcl[(fcl['FUEL_GROUP'] == 'Coal') & fcl['Regulated'].isin(['REG', 'UNR'])]
+    delivered = fcl['QUANTITY'] * fcl['Avg_Heat_Content']
+    priced = fcl['FUEL_COST'].notna()
+
+    receipts = pd.DataFrame({'Regulated': fcl['Regulated'], 'ORIS_ID': fcl['ORIS_ID'], 'MONTH': fcl['MONTH'],
+                             'Cost': (fcl['FUEL_COST'] / 100 * delivered).where(priced),  # for units of $/MMBTU
+                             'MMBTU': delivered.where(priced)})
+    receipts = receipts.groupby(['Regulated', 'ORIS_ID', 'MONTH'], observed=True).sum()
+    annual = receipts.groupby(level=['Regulated', 'ORIS_ID'], observed=True).sum()
+
+    # Every plant with coal receipts gets its monthly rows, once per regulation status (as in the annual tables)
+    plants = (annual['Cost'] / annual['MMBTU']).rename('Annual_Cost').reset_index()
+    costs = monthly.merge(plants, on='ORIS_ID').merge(
+        (receipts['Cost'] / receipts['MMBTU']).rename('Fuel_Cost_($/MMBTU)').reset_index(),
+        on=['Regulated', 'ORIS_ID', 'MONTH'], how='left')
+
+    costs['Fuel_Cost_($/MMBTU)'] = costs['Fuel_Cost_($/MMBTU)'].fillna(costs.pop('Annual_Cost'))
+    costs.loc[costs['Regulated'] == 'UNR', 'Fuel_Cost_($/MMBTU)'] = UNR_FUEL_COST
+
+    # Calculate monthly marginal cost of fuel, and VOPEX with the VOM of the annual tables
+    costs['Heat_Rate_(MMBTU/MWh)'] = costs['FuelCon_MMBTU'] / costs['Gen_MWh']
+    costs['Marginal_Fuel_Cost_($/MWh)'] = costs['Heat_Rate_(MMBTU/MWh)'] * costs['Fuel_Cost_($/MMBTU)']
+    costs['Coal_VOPEX_($/MWh)'] = costs['Marginal_Fuel_Cost_($/MWh)'] + VOM
 
-    year = args.data_year
+    return costs.set_index(['Regulated'] + keys + ['MONTH']).sort_index()
 
-    costsReg = getRegCoalCosts()
-    costsUnr = getUnrCoalCosts()
+
+def heatContent(fcl):
+    """ Average heat content (MMBTU/Short-ton) of all coal receipts, and of unregulated coal plants only """
+
+    coal = fcl[fcl['FUEL_GROUP'] == 'Coal']
+
+    return coal['Avg_Heat_Content'].mean(), coal.loc[coal['Regulated'] == 'UNR', 'Avg_Heat_Content'].mean()
+
+
+def computeCostTables(year, data_dir=None, gen_fuel=None, fuel_costs=None, chunksize=None, parquet=False):
+    """ Plant list, REG, UNR and total coal cost tables for one EIA-923 year, keyed by output file prefix.
+    Already loaded EIA-923 frames can be passed in, others are loaded with chunksize and parquet (see loadGenFuel()).
+    Nothing is printed or written """
+
+    # Each EIA-923 file is read once; both cost paths branch from the same plant list and fuel cost frames
+    if gen_fuel is None:
+        with instrument.stage(f'load GenFuel {year}') as stage:
+            gen_fuel = loadGenFuel(year, data_dir, chunksize=chunksize, parquet=parquet)
+            stage.rows_out = len(gen_fuel)
+
+    with instrument.stage(f'plant list {year}', rows_in=len(gen_fuel)) as stage:
+        cpl = getPlantList(year, gen_fuel)
+        stage.rows_out = len(cpl)
+
+    fcl = fuel_costs if fuel_costs is not None else loadFuelCosts(year, data_dir, chunksize, parquet)
+
+    with instrument.stage(f'REG costs {year}', rows_in=len(fcl)) as stage:
+        costsReg = getRegCoalCosts(year, cpl, fcl)
+        stage.rows_out = len(costsReg)
+
+    with instrument.stage(f'UNR costs {year}', rows_in=len(fcl)) as stage:
+        costsUnr = getUnrCoalCosts(year, cpl, fcl)
+        stage.rows_out = len(costsUnr)
 
     costsTotal = pd.concat([costsReg, costsUnr], ignore_index=True)
 
+    return {'CoalPlantList': cpl, 'CoalCostsReg': costsReg, 'CoalCostsUnr': costsUnr, 'coal_costs_total': costsTotal}
+
+
+def computeCosts(year, data_dir=None):
+    """ Annual operation costs (VOPEX, FOPEX) for regulated and unregulated coal plants in one EIA-923 year """
+    return computeCostTables(year, data_dir)['coal_costs_total']
+
+
+def mergeCosts(year, data_dir=None, output_dir=None, monthly=False, chunksize=None, parquet=False):
+    """ merges annual operation cost dataframes for regulated and unregulated coal plants, and writes the plant list
+    and cost tables to the output directory. monthly=True also writes the monthly cost table. chunksize and parquet:
+    how the EIA-923 files are loaded (see loadGenFuel()) """
+
+    with instrument.stage(f'load FuelCosts {year}') as stage:
+        fcl = loadFuelCosts(year, data_dir, chunksize, parquet)
+        stage.rows_out = len(fcl)
+
+    if monthly:
+        # One page 1 read serves the annual and the monthly tables
+        with instrument.stage(f'load GenFuel {year}') as stage:
+            gen_fuel = loadGenFuel(year, data_dir, monthly=True, chunksize=chunksize, parquet=parquet)
+            stage.rows_out = len(gen_fuel)
+
+        tables = computeCostTables(year, data_dir, gen_fuel[list(GEN_FUEL_COLUMNS.values())], fcl)
+
+        with instrument.stage(f'monthly costs {year}', rows_in=len(gen_fuel)) as stage:
+            tables['CoalCostsMonthly'] = getMonthlyCoalCosts(year, gen_fuel, fcl)
+            stage.rows_out = len(tables['CoalCostsMonthly'])
+    else:
+        tables = computeCostTables(year, data_dir, fuel_costs=fcl, chunksize=chunksize, parquet=parquet)
+
+    avgHeat, unrHeat = heatContent(fcl)
+    logger.info(f'Average heat content for all coal plants ({year}): {avgHeat} MMBTU/Short-ton')
+    logger.info(f'Average heat content of UNR coal plants: {unrHeat} MMBTU/Short-ton')
+
     # Local file output
-    cost_output = os.path.join(coal_output, f'coal_costs_total{year}.csv')
-    costsTotal.to_csv(cost_output, index=False)
+    with instrument.stage(f'write {year}', rows_in=sum(len(table) for table in tables.values())):
+        for name, table in tables.items():
+            # The monthly table keeps its (Regulated, ORIS_ID, Prime_Mover, MONTH) index columns
+            table.to_csv(outputPaths(year, output_dir, monthly)[name], index=name == 'CoalCostsMonthly')
+
+    return tables['coal_costs_total']
+
+
+def outputPaths(year, output_dir=None, monthly=False):
+    """ Output table name --> CSV path for one year """
+    names = ['CoalPlantList', 'CoalCostsReg', 'CoalCostsUnr', 'coal_costs_total']
+    if monthly:
+        names.append('CoalCostsMonthly')
+
+    return {name: os.path.join(output_dir or coal_output, f'{name}{year}.csv') for name in names}
+
+
+def coalInputs(year, data_dir=None):
+    """ Content hashes of everything a year's outputs depend on: both EIA-923 files, and this module (the cost
+    parameters live in the code) """
+
+    return manifest.hashFiles([os.path.join(data_dir or coal_data, f'EIA923GenFuel{year}.csv'),
+                               os.path.join(data_dir or coal_data, f'EIA923FuelCosts{year}.csv'),
+                               os.path.abspath(__file__)])
+
+
+def runParams(year, monthly=False):
+    """ Options recorded in the manifest for a year's outputs """
+    return {'year': year, 'monthly': monthly} if monthly else {'year': year}
+
+
+def openManifest(output_dir=None):
+    return manifest.Manifest(os.path.join(output_dir or coal_output, 'manifest.json'))
+
+
+def updateCosts(year, data_dir=None, output_dir=None, monthly=False, chunksize=None, parquet=False):
+    """ Incremental mergeCosts(): reuses the year's existing outputs when the manifest shows nothing changed """
+
+    runs = openManifest(output_dir)
+    inputs = coalInputs(year, data_dir)
+    paths = outputPaths(year, output_dir, monthly)
+
+    if runs.current(f'coal{year}', inputs, runParams(year, monthly), paths.values()):
+        logger.info(f'{year}: inputs unchanged, keeping existing outputs')
+        instrument.count('years_reused')
+        return pd.read_csv(paths['coal_costs_total'], float_precision='round_trip')
+
+    costs = mergeCosts(year, data_dir, output_dir, monthly, chunksize, parquet)
+    runs.record(f'coal{year}', inputs, runParams(year, monthly), paths.values())
+
+    return costs
+
 
-    return costsTotal
+def readCosts(year, data_dir=None, output_dir=None):
+    """ Read-only counterpart of updateCosts() for long-running readers: the year's coal_costs_total output when the
+    manifest shows it is current (from a run with or without monthly), else the table computed in memory. No output
+    or manifest is written """
 
+    runs = openManifest(output_dir)
+    inputs = coalInputs(year, data_dir)
 
-def main():
-    print(local_path)
+    for monthly in (False, True):
+        paths = outputPaths(year, output_dir, monthly)
+        if runs.current(f'coal{year}', inputs, runParams(year, monthly), paths.values()):
+            instrument.count('years_reused')
+            return pd.read_csv(paths['coal_costs_total'], float_precision='round_trip')
+
+    return computeCosts(year, data_dir)
+
+
+def mergeYears(years, workers=None, incremental=False, monthly=False, chunksize=None, parquet=False):
+    """ Runs mergeCosts() for several years in parallel worker processes, and combines the results into one long
+    panel with a YEAR column. A year that fails is reported and skipped, the others are still written.
+    incremental=True only recomputes years whose inputs changed since the last run """
+
+    results = {}
+    failed = {}
+
+    # The manifest is only read and written here, never from the worker processes
+    runs = openManifest() if incremental else None
+    inputs = {}
+    pending = []
+    for year in years:
+        if runs is not None:
+            try:
+                inputs[year] = coalInputs(year)
+            except OSError as e:
+                failed[year] = e
+                logger.error(f'{year} failed: {e!r}')
+                continue
+
+            paths = outputPaths(year, monthly=monthly)
+            if runs.current(f'coal{year}', inputs[year], runParams(year, monthly), paths.values()):
+                logger.info(f'{year}: inputs unchanged, keeping existing outputs')
+                instrument.count('years_reused')
+                results[year] = pd.read_csv(paths['coal_costs_total'], float_precision='round_trip')
+                continue
+
+        pending.append(year)
+
+    # Stages inside the worker processes are not reported, only the batch as a whole
+    with instrument.stage('years', rows_in=len(pending)) as stage, ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {year: executor.submit(mergeCosts, year, monthly=monthly, chunksize=chunksize,
+                                                parquet=parquet) for year in pending}
+        progress = instrument.Progress(len(futures), 'years')
+
+        for year, future in futures.items():
+            try:
+                results[year] = future.result()
+            except Exception as e:
+                failed[year] = e
+                logger.error(f'{year} failed: {e!r}')
+                continue
+            finally:
+                progress.update()
+
+            if runs is not None:
+                runs.record(f'coal{year}', inputs[year], runParams(year, monthly),
+                            outputPaths(year, monthly=monthly).values())
+
+        stage.rows_out = len(pending) - len(failed)
+
+    if results:
+        panel = pd.concat([results[year].assign(YEAR=year) for year in years if year in results], ignore_index=True)
+        panel = panel[['YEAR'] + [c for c in panel.columns if c != 'YEAR']]
+
+        # Local file output
+        panel_output = os.path.join(coal_output, f'coal_costs_panel{years[0]}-{years[-1]}.csv')
+        panel.to_csv(panel_output, index=False)
+    else:
+        panel = pd.DataFrame()
+
+    return panel, failed
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    instrument.configure(args)
+
+    if args.parquet and pyarrow is None:
+        parser.error('--parquet needs pyarrow (pip install pyarrow)')
+
+    logger.debug(local_path)
 
     cwd = os.getcwd()  # Get the current working directory (cwd)
     files = os.listdir(cwd)  # Get all the files in that directory
-    print(f'Files in {cwd}: {files}')
-
-    print(mergeCosts())
-    print('Finito!')
+    logger.debug(f'Files in {cwd}: {files}')
+
+    with instrument.run(args):
+        if args.data_years is None:
+            if args.incremental:
+                costs = updateCosts(args.data_year, monthly=args.monthly, chunksize=args.chunksize,
+                                    parquet=args.parquet)
+            else:
+                costs = mergeCosts(args.data_year, monthly=args.monthly, chunksize=args.chunksize,
+                                   parquet=args.parquet)
+            logger.debug(costs)
+        else:
+            panel, failed = mergeYears(args.data_years, args.workers, args.incremental, args.monthly, args.chunksize,
+                                       args.parquet)
+            logger.debug(panel)
+
+            if failed:
+                sys.exit(f'Failed years: {", ".join(str(y) for y in failed)}')
+
+    logger.info('Finito!')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,315 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import urllib.parse
+import urllib.error
+import http.client
+import threading
+import hashlib
+import atexit
+import gzip
+import time
+import os
+
+if __package__:
+    from . import instrument
+else:  # run as a script, or imported from the repository directory
+    import instrument
+
+local_path = os.path.dirname(os.path.abspath(__file__))
+
+# HTTP status codes worth retrying (rate limited, or transient server-side failures)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Query parameters left out of archive keys: credentials, so recordings replay with any key
+PRIVATE_PARAMS = {'api_key', 'email'}
+
+FETCH_MODES = ['live', 'record', 'replay', 'stub']
+
+
+def addArguments(parser, source):
+    """ NREL API credentials and download options shared by the command line tools (source: e.g. 'NSRDB') """
+
+    parser.add_argument('--api_key', type=str, help='NREL API Key. Sign up @ https://developer.nrel.gov/signup/',
+                        required=True)
+    parser.add_argument('--email', type=str, help='Email address.', required=True)
+    parser.add_argument('--workers', type=int, default=4, help=f'Number of concurrent {source} downloads, default 4')
+    parser.add_argument('--requests_per_second', type=float, default=1.0,
+                        help='Download rate limit shared by all workers (NREL API quota), default 1.0')
+    parser.add_argument('--retries', type=int, default=5, help='Retries per download on HTTP 429/5xx, default 5')
+    parser.add_argument('--fetch_mode', type=str, choices=FETCH_MODES, default='live',
+                        help='live: NREL API; record: NREL API, saving every response to the archive; replay: '
+                             'responses from the archive only (no network); stub: synthetic responses from a local '
+                             'stand-in server. Default: live')
+    parser.add_argument('--archive', type=str, default=os.path.join(local_path, 'resource_archive'),
+                        help='Response archive of record/replay mode, default resource_archive/')
+
+
+class DownloadError(Exception):
+    """ Raised when one or more resource downloads still fail after all retries; .failures holds (url, error) """
+
+    def __init__(self, message, failures=()):
+        super().__init__(message)
+        self.failures = list(failures)
+
+
+class ReplayMiss(LookupError):
+    """ Raised in replay mode for a request that is not in the archive """
+
+
+def archiveKey(url):
+    """ Archive key of a request: hash of its path and sorted query, without host and credentials """
+
+    parts = urllib.parse.urlsplit(url)
+    query = sorted((key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                   if key not in PRIVATE_PARAMS)
+
+    return hashlib.sha256(f'{parts.path}?{urllib.parse.urlencode(query)}'.encode()).hexdigest()
+
+
+class Archive:
+    """ Directory of recorded response bodies, one gzip file per request """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, url):
+        return os.path.join(self.root, f'{archiveKey(url)}.gz')
+
+    def get(self, url):
+        try:
+            with open(self.path(url), 'rb') as f:
+                return gzip.decompress(f.read())
+        except FileNotFoundError:
+            return None
+
+    def put(self, url, content):
+        saveFile(self.path(url), gzip.compress(content))
+
+
+class LiveTransport:
+    """ HTTP(S) GETs over persistent connections: each download thread keeps one keep-alive connection per host, so
+    repeated requests skip TCP/TLS setup. base (e.g. 'http://127.0.0.1:8000') sends every request to another server,
+    keeping path and query """
+
+    def __init__(self, base=None):
+        self.base = urllib.parse.urlsplit(base) if base else None
+        self.local = threading.local()
+
+    def connection(self, scheme, netloc, timeout):
+        pool = self.local.__dict__.setdefault('pool', {})
+
+        if (scheme, netloc) not in pool:
+            connection = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            pool[(scheme, netloc)] = connection(netloc, timeout=timeout)
+
+        return pool[(scheme, netloc)]
+
+    def get(self, url, timeout=120):
+        for _ in range(5):  # redirects
+            parts = urllib.parse.urlsplit(url)
+            if self.base is not None:
+                parts = parts._replace(scheme=self.base.scheme, netloc=self.base.netloc)
+
+            response, content = self.request(parts, timeout)
+
+            location = response.getheader('Location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                url = urllib.parse.urljoin(url, location)
+                continue
+
+            if response.status != 200:
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+
+            return content
+
+        raise urllib.error.HTTPError(url, response.status, 'too many redirects', response.headers, None)
+
+    def request(self, parts, timeout):
+        target = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+
+        # A kept-alive connection the server has since closed fails on first use: reconnect once right away
+        for attempt in range(2):
+            connection = self.connection(parts.scheme, parts.netloc, timeout)
+            reused = connection.sock is not None
+            try:
+                connection.request('GET', target)
+                response = connection.getresponse()
+                return response, response.read()
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                if not reused or attempt == 1:
+                    raise ConnectionError(f'{parts.netloc}: {e!r}') from e
+
+
+class RecordTransport:
+    """ Live requests whose responses are also saved to an archive """
+
+    def __init__(self, archive, live=None):
+        self.archive = archive
+        self.live = live or LiveTransport()
+
+    def get(self, url, timeout=120):
+        content = self.live.get(url, timeout)
+        self.archive.put(url, content)
+        return content
+
+
+class ReplayTransport:
+    """ Responses from an archive only; requests that were never recorded raise ReplayMiss """
+
+    def __init__(self, archive):
+        self.archive = archive
+
+    def get(self, url, timeout=120):
+        content = self.archive.get(url)
+        if content is None:
+            raise ReplayMiss(f'{archiveKey(url)} not in {self.archive.root}: record it first (--fetch_mode record)')
+        return content
+
+
+# Transport of every download in this process (see configure())
+transport = LiveTransport()
+
+# Local stand-in server of stub mode, if one is running
+stub_server = None
+
+
+def releaseStub():
+    """ Shut down the stub mode server (on a new configure() call, and at exit) """
+
+    global stub_server
+
+    if stub_server is not None:
+        stub_server.__exit__(None, None, None)
+        stub_server = None
+
+
+atexit.register(releaseStub)
+
+
+def configure(args):
+    """ Apply the command line fetch mode. stub mode starts the local stand-in server of fixtures.py """
+
+    global transport, stub_server
+
+    releaseStub()
+
+    if args.fetch_mode == 'live':
+        transport = LiveTransport()
+    elif args.fetch_mode == 'record':
+        transport = RecordTransport(Archive(args.archive))
+    elif args.fetch_mode == 'replay':
+        transport = ReplayTransport(Archive(args.archive))
+    else:
+        if __package__:
+            from . import fixtures
+        else:
+            import fixtures
+        stub_server = fixtures.StubServer().__enter__()
+        transport = LiveTransport(f'http://127.0.0.1:{stub_server.httpd.server_address[1]}')
+
+
+class TokenBucket:
+    """ Token-bucket rate limiter shared by all download threads (rate in requests/second) """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until a request may be sent """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+def fetchUrl(url, bucket=None, retries=5, backoff=2.0, timeout=120):
+    """ GET a url and return the raw response body, retrying with exponential backoff on 429/5xx and network errors """
+
+    for attempt in range(retries + 1):
+        if bucket is not None:
+            bucket.acquire()
+
+        try:
+            start = time.perf_counter()
+            content = transport.get(url, timeout)
+            instrument.report.fetched(time.perf_counter() - start, len(content))
+            return content
+
+        except urllib.error.HTTPError as e:
+            if e.code not in RETRY_STATUS or attempt == retries:
+                raise
+            # Honour the server's Retry-After hint when rate limited
+            retry_after = e.headers.get('Retry-After') if e.headers else None
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else backoff * 2 ** attempt
+
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+
+        instrument.count('http_retries')
+        time.sleep(delay)
+
+
+def saveFile(path, content):
+    """ Write downloaded bytes atomically, so an interrupted run never leaves a truncated cache file behind """
+
+    part = f'{path}.part'
+    with open(part, 'wb') as f:
+        f.write(content)
+    os.replace(part, path)
+
+
+def fetchAll(urls, handler, workers=4, rate=1.0, retries=5, backoff=2.0):
+    """ Download urls concurrently under a shared rate limit.
+
+    handler(i, content) is called in the calling thread as soon as urls[i] arrives, so results are persisted
+    immediately and an interrupted run resumes from where it stopped. Returns the handler results in input order. """
+
+    results = [None] * len(urls)
+    if not urls:
+        return results
+
+    bucket = TokenBucket(rate)
+    failed = []
+    progress = instrument.Progress(len(urls), 'download')
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(fetchUrl, url, bucket, retries, backoff): i for i, url in enumerate(urls)}
+
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                content = future.result()
+            except Exception as e:
+                failed.append((urls[i], e))
+                progress.update()
+                continue
+
+            results[i] = handler(i, content)
+            progress.update()
+
+    finally:
+        # On interruption, drop queued downloads instead of waiting for them
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    if failed:
+        raise DownloadError(f'{len(failed)} of {len(urls)} downloads failed (first: {failed[0][1]}); re-run to resume',
+                            failed)
+
+    return results
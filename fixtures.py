@@ -0,0 +1,158 @@
+import pandas as pd
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import threading
+import random
+import time
+import os
+
+if __package__:
+    from . import coal
+else:  # run as a script, or imported from the repository directory
+    import coal
+
+# Plant Id of the EIA-923 state-level fuel increment rows, which must stay recognisable in scaled tables
+STATE_INCREMENT_ID = 99999
+
+# Plant Id offset of each copy of the real tables in scaled fixtures (above every real id)
+PLANT_ID_STRIDE = 100000
+
+
+def scaleTable(path, scale):
+    """ An EIA-923 CSV repeated scale times, each copy with its own Plant Ids, so plant counts, joins and group sizes
+    grow with the rows. Values are kept as text, so the copies parse exactly like the real file """
+
+    table = pd.read_csv(path, dtype=str, keep_default_na=False)
+    ids = table['Plant Id'].astype(np.int64)
+
+    copies = []
+    for copy in range(scale):
+        shifted = np.where(ids == STATE_INCREMENT_ID, ids, ids + copy * PLANT_ID_STRIDE)
+        copies.append(table.assign(**{'Plant Id': shifted.astype(str)}))
+
+    return pd.concat(copies, ignore_index=True)
+
+
+def writeEIA923(year, scale, out_dir, data_dir=None):
+    """ Synthetic EIA-923 GenFuel and FuelCosts files at scale x the real row counts, in out_dir (usable as
+    coal.py's data_dir). Returns the row counts written """
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    rows = {}
+    for name in (f'EIA923GenFuel{year}.csv', f'EIA923FuelCosts{year}.csv'):
+        table = scaleTable(os.path.join(data_dir or coal.coal_data, name), scale)
+        table.to_csv(os.path.join(out_dir, name), index=False)
+        rows[name] = len(table)
+
+    return rows
+
+
+def srwFile(lat, lon, height=100, hours=8760):
+    """ Synthetic WIND Toolkit SRW file (header, units and hub height rows, hourly data), seeded by the location """
+
+    rng = np.random.default_rng(abs(hash((round(lat, 6), round(lon, 6), height))) % 2 ** 32)
+    speed = np.round(rng.weibull(2.0, hours) * rng.uniform(6, 10), 2)
+
+    lines = ['SiteID,Site Timezone,Data Timezone,Longitude,Latitude', f'0,-5,0,{lon},{lat}',
+             'Temperature,Pressure,Direction,Speed', 'C,atm,degrees,m/s', ','.join([str(height)] * 4)]
+    lines += [f'{t:.1f},{p:.4f},{d},{s}' for t, p, d, s in zip(np.round(rng.uniform(-10, 35, hours), 1),
+                                                                 rng.uniform(0.95, 1.0, hours),
+                                                                 rng.integers(0, 360, hours), speed)]
+
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def psm3File(lat, lon, year=2020, hours=8760):
+    """ Synthetic NSRDB PSM v3 file (metadata rows, hourly irradiance and temperature), seeded by the location """
+
+    rng = np.random.default_rng(abs(hash((round(lat, 6), round(lon, 6)))) % 2 ** 32)
+    hour = np.arange(hours) % 24
+    sun = np.clip(np.sin((hour - 6) / 12 * np.pi), 0, None)
+    ghi = np.round(sun * rng.uniform(600, 1000, hours)).astype(int)
+
+    lines = ['Source,Location ID,City,State,Country,Latitude,Longitude,Time Zone,Elevation,Local Time Zone',
+             f'NSRDB,{rng.integers(10 ** 5, 10 ** 6)},-,-,-,{round(lat, 2)},{round(lon, 2)},0,'
+             f'{rng.integers(0, 2000)},-5',
+             'Year,Month,Day,Hour,Minute,GHI,DNI,DHI,Temperature']
+    lines += [f'{year},1,1,{h},30,{g},{int(g * 0.8)},{int(g * 0.2)},{t:.1f}'
+              for h, g, t in zip(hour, ghi, np.round(rng.uniform(-5, 30, hours), 1))]
+
+    return ('\n'.join(lines) + '\n').encode()
+
+
+class StubServer:
+    """ Local stand-in for the NREL download API: serves synthetic SRW files for WIND Toolkit paths (any path with
+    'wtk', e.g. /wtk) and PSM v3 files for the others, for the lat/lon (or POINT wkt) in the query. Connections are
+    kept alive. latency (s) plus a random delay of up to jitter (s) is added to every response. Use as a context
+    manager; .wtk_url / .nsrdb_url replace wind.WTK_URL / solar.NSRDB_URL.
+
+    .fail(statuses, retry_after) answers the next requests with the given HTTP error statuses, in order, to exercise
+    the client's retries. .requests counts the files served, .failed the error responses """
+
+    def __init__(self, latency=0.0, jitter=0.0):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                time.sleep(server.latency + random.uniform(0, server.jitter))
+
+                with server.lock:
+                    status = server.failures.pop(0) if server.failures else None
+                    if status is not None:
+                        server.failed += 1
+
+                if status is not None:
+                    self.send_response(status)
+                    if server.retry_after is not None:
+                        self.send_header('Retry-After', str(server.retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                if 'wtk' in url.path:
+                    body = srwFile(float(query['lat'][0]), float(query['lon'][0]), int(query['hubheight'][0]))
+                else:
+                    lon, lat = query['wkt'][0][len('POINT('):-1].replace('+', ' ').split()
+                    body = psm3File(float(lat), float(lon), int(query['names'][0]))
+
+                with server.lock:
+                    server.requests += 1
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self.failed = 0
+        self.failures = []
+        self.retry_after = None
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.wtk_url = f'http://127.0.0.1:{self.httpd.server_address[1]}/wtk'
+        self.nsrdb_url = f'http://127.0.0.1:{self.httpd.server_address[1]}/nsrdb'
+
+    def fail(self, statuses, retry_after=None):
+        """ Answer the next len(statuses) requests with these HTTP error statuses, with a Retry-After header (s) if
+        retry_after is given """
+        with self.lock:
+            self.failures = list(statuses)
+            self.retry_after = retry_after
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
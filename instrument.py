@@ -0,0 +1,155 @@
+import numpy as np
+from contextlib import contextmanager
+import threading
+import logging
+import json
+import time
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS in the run report
+    resource = None
+
+logger = logging.getLogger('eqsystemcosts')
+
+
+def peakRSS():
+    """ Peak resident memory of this process so far (MB), or None where it cannot be measured """
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+class RunReport:
+    """ Stage timings, peak memory, counters and HTTP fetch statistics of one run. Thread-safe, so download threads
+    can record into it """
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = []
+        self.counters = {}
+        self.latencies = []
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def fetched(self, seconds, nbytes):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.bytes += nbytes
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """ Time a pipeline stage; set .rows_out on the yielded record to report the rows it produced """
+
+        record = Stage(name, rows_in)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.wall_s = time.perf_counter() - start
+            record.peak_rss_mb = peakRSS()
+            with self.lock:
+                self.stages.append(record)
+            logger.debug(f'{name}: {record.wall_s:.3f} s')
+
+    def toDict(self):
+        latencies = np.array(self.latencies)
+        http = {'requests': len(latencies), 'bytes': self.bytes}
+        if len(latencies):
+            http['latency_s'] = dict(zip(['p50', 'p90', 'p99', 'max'],
+                                         np.percentile(latencies, [50, 90, 99, 100]).tolist()))
+
+        return {'command': sys.argv, 'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'wall_s': time.time() - self.started, 'peak_rss_mb': peakRSS(),
+                'stages': [vars(stage) for stage in self.stages], 'counters': dict(self.counters), 'http': http}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.toDict(), f, indent=1)
+
+
+class Stage:
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.wall_s = None
+        self.peak_rss_mb = None
+
+
+class Progress:
+    """ Single-line progress bar on stderr; does nothing unless progress bars are switched on """
+
+    enabled = False
+
+    def __init__(self, total, description):
+        self.total = total
+        self.description = description
+        self.done = 0
+        self.lock = threading.Lock()
+        self.active = Progress.enabled and total > 0
+
+    def update(self, n=1):
+        if not self.active:
+            return
+
+        with self.lock:
+            self.done += n
+            filled = int(30 * self.done / self.total)
+            sys.stderr.write(f'\r{self.description} [{"#" * filled}{"." * (30 - filled)}] {self.done}/{self.total}')
+            if self.done >= self.total:
+                sys.stderr.write('\n')
+            sys.stderr.flush()
+
+
+# Report of the current run, shared by every module
+report = RunReport()
+
+
+def stage(name, rows_in=None):
+    return report.stage(name, rows_in)
+
+
+def count(name, n=1):
+    report.count(name, n)
+
+
+def addArguments(parser):
+    """ Logging, run report and progress bar options shared by the command line tools """
+
+    parser.add_argument('--log_level', type=str, default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='Console verbosity: DEBUG also prints the site lists and tables, WARNING keeps '
+                             'production runs quiet. Default: INFO')
+    parser.add_argument('--report', type=str, default=None,
+                        help='Write a JSON run report (stage timings, peak memory, counters, HTTP statistics) here')
+    parser.add_argument('--progress', action='store_true', help='Show progress bars for downloads and site loops')
+
+
+def configure(args):
+    """ Apply the shared command line options """
+
+    # Console output stays on stdout, as the print() calls it replaces; progress bars go to stderr
+    logging.basicConfig(format='%(message)s', level=args.log_level, stream=sys.stdout)
+    logger.setLevel(args.log_level)
+    Progress.enabled = args.progress
+
+
+@contextmanager
+def run(args):
+    """ Wrap a command line run: the report is written at the end even when the run fails """
+
+    try:
+        yield report
+    finally:
+        if args.report:
+            report.write(args.report)
+            logger.info(f'Run report: {args.report}')
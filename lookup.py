@@ -0,0 +1,208 @@
+import pandas as pd
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import argparse
+import threading
+import json
+import re
+import os
+
+if __package__:
+    from . import coal, instrument
+    from .instrument import logger
+else:  # run as a script, or imported from the repository directory
+    import coal
+    import instrument
+    from instrument import logger
+
+# CLI arguments
+parser = argparse.ArgumentParser(description='Local HTTP/JSON service for plant-level coal VOPEX/FOPEX lookups')
+parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface to listen on, default 127.0.0.1')
+parser.add_argument('--port', type=int, default=8923, help='Port to listen on, default 8923')
+parser.add_argument('--reload_interval', type=float, default=60.0,
+                    help='Seconds between checks of coal_plant_data/ for new or changed EIA-923 years; 0 disables '
+                         'hot reload. Default: 60')
+instrument.addArguments(parser)
+
+EIA923_FILE = re.compile(r'EIA923GenFuel(\d{4})\.csv$')
+
+
+class CostIndex:
+    """ In-memory coal cost tables of every EIA-923 year in the data directory, keyed by (year, ORIS_ID).
+
+    Years are loaded with coal.readCosts(): current outputs of coal.py are read, other years are computed in memory.
+    Nothing is written, so the index never races a coal.py run over the outputs or their manifest. refresh() picks
+    up years that were added or changed since the last load; lookups are served from immutable snapshots, so they
+    never wait for a reload """
+
+    def __init__(self, data_dir=None, output_dir=None):
+        self.data_dir = data_dir or coal.coal_data
+        self.output_dir = output_dir
+        self.signatures = {}
+        self.tables = {}
+        self.records = {}
+        self.lock = threading.Lock()
+        self.refresh()
+
+    def available(self):
+        """ {year: (size, mtime) of both EIA-923 files} for every year with both files in the data directory """
+
+        signatures = {}
+        for name in os.listdir(self.data_dir):
+            match = EIA923_FILE.match(name)
+            if match is None:
+                continue
+
+            year = int(match.group(1))
+            paths = [os.path.join(self.data_dir, f'EIA923{page}{year}.csv') for page in ('GenFuel', 'FuelCosts')]
+            if all(os.path.exists(path) for path in paths):
+                signatures[year] = tuple((os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in paths)
+
+        return signatures
+
+    def refresh(self):
+        """ Load new and changed years, drop removed ones. Returns the years (re)loaded """
+
+        with self.lock:
+            signatures = self.available()
+            changed = sorted(year for year, signature in signatures.items()
+                             if self.signatures.get(year) != signature)
+            if not changed and signatures.keys() == self.signatures.keys():
+                return []
+
+            tables = {year: table for year, table in self.tables.items() if year in signatures}
+            for year in changed:
+                try:
+                    tables[year] = coal.readCosts(year, self.data_dir, self.output_dir)
+                except Exception as e:
+                    # Keep serving the previous version of a year that fails to load
+                    logger.error(f'{year} failed: {e!r}')
+                    signatures.pop(year)
+                    continue
+                logger.info(f'{year}: {len(tables[year])} plants loaded')
+
+            records = {}
+            for year, table in tables.items():
+                rows = table.astype(object).where(table.notna(), None).to_dict('records')
+                for row in rows:
+                    # Plants with regulated and unregulated receipts have a row in each table
+                    records.setdefault((year, row['ORIS_ID']), []).append({'YEAR': year, **row})
+
+            # Swap in the new snapshot in one step
+            self.tables, self.records = tables, records
+            self.signatures = {year: signatures.get(year, self.signatures.get(year)) for year in tables}
+
+        return changed
+
+    def watch(self, interval=60.0):
+        """ Poll the data directory for new or changed years in a background thread """
+
+        def poll():
+            while not stop.wait(interval):
+                self.refresh()
+
+        stop = threading.Event()
+        threading.Thread(target=poll, daemon=True).start()
+
+        return stop
+
+    @property
+    def years(self):
+        return sorted(self.tables)
+
+    def get(self, year, oris_id):
+        """ Cost rows (dicts with YEAR and the coal_costs_total columns) of one plant in one year; [] if there are
+        none """
+        return self.records.get((year, oris_id), [])
+
+    def query(self, year=None, state=None, sector=None, oris_ids=None):
+        """ Cost rows of every plant matching the filters (state code, EIA sector number, ORIS_IDs), all years by
+        default """
+
+        rows = []
+        for table_year, table in sorted(self.tables.items()):
+            if year is not None and table_year != year:
+                continue
+
+            mask = pd.Series(True, index=table.index)
+            if state is not None:
+                mask &= table['State'] == state
+            if sector is not None:
+                mask &= table['EIA_Sector'] == sector
+            if oris_ids is not None:
+                mask &= table['ORIS_ID'].isin(oris_ids)
+
+            rows += [row for oris_id in table.loc[mask, 'ORIS_ID'].unique() for row in self.get(table_year, oris_id)]
+
+        return rows
+
+
+def makeServer(index, host='127.0.0.1', port=8923):
+    """ HTTP server for an index:
+
+        GET /years                                          --> [2019, 2020, ..]
+        GET /costs?year=2020&oris_id=3                      --> cost rows of one plant
+        GET /costs?year=2020&state=PA&sector=1&oris_id=..   --> every plant matching the filters (all optional) """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+
+            try:
+                if url.path == '/years':
+                    body = index.years
+                elif url.path == '/costs':
+                    year = int(query['year'][0]) if 'year' in query else None
+                    oris_ids = [int(v) for v in query.get('oris_id', [])]
+                    if year is not None and len(oris_ids) == 1 and len(query) == 2:
+                        body = index.get(year, oris_ids[0])
+                    else:
+                        body = index.query(year, query.get('state', [None])[0],
+                                           int(query['sector'][0]) if 'sector' in query else None,
+                                           oris_ids or None)
+                else:
+                    return self.reply(404, {'error': f'unknown path {url.path}'})
+            except ValueError as e:
+                return self.reply(400, {'error': str(e)})
+
+            self.reply(200, body)
+
+        def reply(self, status, body):
+            content = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    instrument.configure(args)
+
+    with instrument.run(args):
+        index = CostIndex()
+        logger.info(f'Years loaded: {index.years}')
+
+        if args.reload_interval > 0:
+            index.watch(args.reload_interval)
+
+        server = makeServer(index, args.host, args.port)
+        logger.info(f'Serving http://{args.host}:{server.server_address[1]}/costs')
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main()
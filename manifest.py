@@ -0,0 +1,109 @@
+import pandas as pd
+import hashlib
+import json
+import os
+
+local_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def fileHash(path, chunk_size=1 << 20):
+    """ SHA-256 of a file's contents, read in chunks """
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def hashFiles(paths):
+    """ {path relative to the repository: content hash} for a list of files """
+    return {os.path.relpath(path, local_path): fileHash(path) for path in paths}
+
+
+class Manifest:
+    """ JSON record of how each output was produced: input file hashes, run parameters and output file hashes, per
+    output key. An output is current when its inputs and parameters are unchanged and its files are still exactly
+    what the last run wrote """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def current(self, key, inputs, params, outputs):
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+
+        # Compare in JSON form, so tuples and lists of the same values match
+        if entry['inputs'] != inputs or entry['params'] != json.loads(json.dumps(params)):
+            return False
+
+        return all(os.path.exists(path) and fileHash(path) == entry['outputs'].get(os.path.basename(path))
+                   for path in outputs)
+
+    def record(self, key, inputs, params, outputs, **info):
+        """ Store one output's provenance (extra info, e.g. the requested sites, is kept but not compared) """
+
+        self.entries[key] = {'inputs': inputs, 'params': json.loads(json.dumps(params)),
+                             'outputs': {os.path.basename(path): fileHash(path) for path in outputs}, **info}
+
+        # Write-then-rename, so an interrupted run never leaves a truncated manifest
+        part = f'{self.path}.part'
+        with open(part, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(part, self.path)
+
+
+def mergeSites(previous, coords, compute):
+    """ Per-site output for the requested (lat, lon) coords, reusing the rows of a previous output where possible.
+
+    compute(missing) is only called for sites that are not in previous (None: nothing to reuse). Rows come back in
+    the order of coords, as a full run would write them; sites no longer requested are dropped """
+
+    done = set() if previous is None else set(zip(previous['lat'].tolist(), previous['lon'].tolist()))
+    missing = [coord for coord in coords if coord not in done]
+
+    frames = [] if previous is None else [previous]
+    if missing:
+        frames.append(compute(missing))
+
+    return orderSites(pd.concat(frames, ignore_index=True), coords), len(missing)
+
+
+def orderSites(data, coords):
+    """ Rows of a per-site output for the requested coords only, in the order of coords """
+
+    # Stable sort keeps the row order within a site (one row per year in tidy output)
+    order = {coord: i for i, coord in enumerate(coords)}
+    rank = pd.Series([order.get(key, -1) for key in zip(data['lat'].tolist(), data['lon'].tolist())])
+
+    data = data[rank.to_numpy() >= 0]
+    rank = rank[rank >= 0]
+
+    return data.iloc[rank.argsort(kind='stable')].reset_index(drop=True)
+
+
+def updateSites(out_path, inputs, params, coords, compute, **info):
+    """ Incremental per-site output: when the manifest next to out_path shows the same inputs and parameters, the
+    previous output's rows are reused and compute(missing) only runs for sites that are new. Writes out_path and
+    records the run. Returns the output and the number of sites computed """
+
+    runs = Manifest(os.path.join(os.path.dirname(out_path), 'manifest.json'))
+    key = os.path.splitext(os.path.basename(out_path))[0]
+
+    previous = None
+    if runs.current(key, inputs, params, [out_path]):
+        previous = pd.read_csv(out_path, float_precision='round_trip')
+
+    data, computed = mergeSites(previous, coords, compute)
+
+    data.to_csv(out_path, index=False)
+    runs.record(key, inputs, params, [out_path], sites=len(coords), **info)
+
+    return data, computed
@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+
+if __package__:
+    from . import download, sites, wind, solar, instrument
+    from .instrument import logger
+else:  # run as a script, or imported from the repository directory
+    import download
+    import sites
+    import wind
+    import solar
+    import instrument
+    from instrument import logger
+
+local_path = os.path.dirname(os.path.abspath(__file__))
+
+# Technology --> module with its siteCosts()
+TECHS = {'wind': wind, 'solar': solar}
+
+# CLI arguments
+parser = argparse.ArgumentParser(description='Joined wind and solar resource and cost table for one set of sites')
+parser.add_argument('--techs', nargs='+', type=str, choices=list(TECHS), default=list(TECHS),
+                    help='Technologies to compute for every site, default wind solar')
+parser.add_argument('--wind_year', type=int, choices=[2010, 2011, 2012, 2013, 2014],
+                    help='WIND Toolkit data year, 2010-2014 (inclusive). Required for wind')
+parser.add_argument('--solar_year', type=int, choices=[2016, 2017, 2018, 2019, 2020],
+                    help='NSRDB data year, 2016-2020 (inclusive). Required for solar')
+download.addArguments(parser, 'WIND Toolkit / NSRDB')
+sites.addGeometryArguments(parser)
+parser.add_argument('--cost_years', type=sites.yearSpan, default=None,
+                    help="ATB cost projection years, e.g. '2021-2030' or '2025,2030'. "
+                         "Default: every year in the ATB file")
+parser.add_argument('--tidy', action='store_true',
+                    help='Long output: one row per site and year instead of one CAPEX/FOPEX column pair per year')
+parser.add_argument('--snap_to_grid', action='store_true',
+                    help='Snap sites to the native WIND Toolkit / NSRDB grids before downloading')
+parser.add_argument('--hub_heights', nargs='+', type=int, choices=wind.HUB_HEIGHTS, default=[100],
+                    help='Wind hub heights (m) to fetch and summarize, default 100')
+parser.add_argument('--wind_stats', action='store_true',
+                    help='Also output mean and P90 wind speed, and a capacity factor proxy for every site')
+parser.add_argument('--out', type=str, default=None,
+                    help='Output CSV, default hybrid_data_output/{techs}_costs.csv, e.g. wind_solar_costs.csv')
+instrument.addArguments(parser)
+
+
+def siteTable(coords, techs, years, api_key, email, workers=4, rate=1.0, retries=5, snap=False, cost_years=None,
+              tidy=False, wind_stats=False, hub_heights=(100,)):
+    """ One table of resource and ATB cost columns for several technologies over the same (lat, lon) coordinates.
+
+    years: {tech: data year}. Each technology's siteCosts() runs in its own thread, so WIND Toolkit and NSRDB
+    downloads overlap (workers and rate apply to each source). Cost columns are prefixed with the technology,
+    e.g. wind_CAPEX_($/MW)_2030; rows are in coords order (and YEAR order with tidy=True) """
+
+    def techCosts(tech):
+        options = {'stats': wind_stats, 'heights': hub_heights} if tech == 'wind' else {}
+        return TECHS[tech].siteCosts(coords, years[tech], api_key, email, workers, rate, retries, snap=snap,
+                                     cost_years=cost_years, tidy=tidy, **options)
+
+    with ThreadPoolExecutor(max_workers=len(techs)) as executor:
+        tables = list(executor.map(techCosts, techs))
+
+    with instrument.stage('join', rows_in=sum(len(table) for table in tables)) as stage:
+        keys = ['lat', 'lon', 'YEAR'] if tidy else ['lat', 'lon']
+        costs = ('CAPEX_($/MW)', 'FOPEX_($/MW)')
+
+        joined = None
+        for tech, table in zip(techs, tables):
+            table = table.rename(columns=lambda c: f'{tech}_{c}' if c.startswith(costs) else c)
+            joined = table if joined is None else joined.merge(table, on=keys, how='left')
+
+        stage.rows_out = len(joined)
+
+    return joined
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    instrument.configure(args)
+    download.configure(args)
+
+    years = {'wind': args.wind_year, 'solar': args.solar_year}
+    missing = [tech for tech in args.techs if years[tech] is None]
+    if missing:
+        parser.error(f'{", ".join(f"--{tech}_year" for tech in missing)} required')
+
+    out_path = args.out or os.path.join(local_path, f'hybrid_data_output/{"_".join(args.techs)}_costs.csv')
+
+    with instrument.run(args):
+        # Coordinates (and state geometry) are built once for every technology
+        with instrument.stage('coordinates') as stage:
+            coords = sites.getCoords(args)
+            stage.rows_out = len(coords)
+        logger.debug(coords)
+        logger.info(f'{len(coords)} coordinates found...')
+
+        table = siteTable(coords, args.techs, years, args.api_key, args.email, args.workers,
+                          args.requests_per_second, args.retries, args.snap_to_grid, args.cost_years, args.tidy,
+                          args.wind_stats, args.hub_heights)
+
+        with instrument.stage('write', rows_in=len(table)):
+            table.to_csv(out_path, index=False)
+
+    logger.info(f'{len(table)} rows --> {out_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import pandas as pd
+import numpy as np
+import argparse
+import os
+
+if __package__:
+    from . import cache, solar, wind
+else:  # run as a script, or imported from the repository directory
+    import cache
+    import solar
+    import wind
+
+local_path = os.path.dirname(os.path.abspath(__file__))
+
+HOURS = 8760
+
+# Simplified PV model: horizontal array, cell temperature from the NOCT model, fixed system losses, and output
+# clipped at the inverter rating (capacity factors are per MW AC)
+PV_TEMP_COEFF = -0.004  # 1/C, relative power change per degree of cell temperature above 25 C
+PV_NOCT = 45.0  # C, nominal operating cell temperature (at 800 W/m2, 20 C ambient)
+PV_LOSSES = 0.14  # soiling, wiring, mismatch, availability ..
+PV_ILR = 1.3  # inverter loading ratio (DC/AC)
+
+# CLI arguments
+parser = argparse.ArgumentParser(description='Hourly capacity factor profiles from cached WIND Toolkit / NSRDB data')
+parser.add_argument('--tech', type=str, required=True, choices=['wind', 'solar'])
+parser.add_argument('--data_year', type=int, required=True, help='Year of the cached resource data')
+parser.add_argument('--sites', type=str, default=None,
+                    help='CSV with lat and lon columns (e.g. a wind_costs.csv) for the sites to convert, in that '
+                         'order. Default: every cached site of the year')
+parser.add_argument('--power_curve', type=str, default=None,
+                    help='Wind only: CSV with speed (m/s) and cf columns, interpolated linearly and zero outside the '
+                         'listed speeds. Default: generic cubic curve (3/12/25 m/s cut-in/rated/cut-out)')
+parser.add_argument('--hub_height', type=int, choices=wind.HUB_HEIGHTS, default=100,
+                    help='Wind only: hub height (m) of the cached WIND Toolkit data, default 100')
+parser.add_argument('--batch_size', type=int, default=1000, help='Sites converted per batch, default 1000')
+
+
+def loadPowerCurve(path):
+    """ Power curve CSV (speed, cf) --> (speeds, cfs) arrays sorted by speed """
+
+    curve = pd.read_csv(path).sort_values('speed')
+
+    return curve['speed'].to_numpy(dtype=np.float64), curve['cf'].to_numpy(dtype=np.float64)
+
+
+def windCF(speed, curve=None):
+    """ Hourly wind speeds (m/s, any shape) --> capacity factors, from a tabulated power curve (speeds, cfs) or the
+    generic curve in wind.py """
+
+    if curve is None:
+        return wind.powerCurveCF(speed)
+
+    speeds, cfs = curve
+    return np.interp(speed, speeds, cfs, left=0, right=0)
+
+
+def solarCF(ghi, temperature):
+    """ Hourly GHI (W/m2) and air temperature (C), any shape --> capacity factors of the simplified PV model """
+
+    cell_temperature = temperature + ghi / 800 * (PV_NOCT - 20)
+    dc = PV_ILR * ghi / 1000 * (1 + PV_TEMP_COEFF * (cell_temperature - 25)) * (1 - PV_LOSSES)
+
+    return np.clip(dc, 0, 1)
+
+
+def toHours(cf):
+    """ Profiles (sites x time steps) at hourly or sub-hourly resolution --> sites x 8760 hourly means. Leap year
+    data (8784 hours) drops Feb 29, so every profile lines up on the same 8760 hours """
+
+    steps = cf.shape[1]
+
+    for hours in (HOURS, HOURS + 24):
+        if steps % hours == 0:
+            cf = cf.reshape(len(cf), hours, steps // hours).mean(axis=2)
+            if hours > HOURS:
+                cf = np.delete(cf, np.s_[59 * 24:60 * 24], axis=1)
+            return cf
+
+    raise ValueError(f'{steps} time steps per site is not an hourly or sub-hourly year')
+
+
+# tech --> (resource cache dataset, cached columns the conversion to capacity factors takes)
+RESOURCES = {'wind': (wind.WTK_DATASET, ['Speed']),
+             'solar': (solar.NSRDB_DATASET, ['GHI', 'Temperature'])}
+
+
+def resourceDataset(tech, height=100):
+    return wind.wtkDataset(height) if tech == 'wind' else RESOURCES[tech][0]
+
+
+def generateProfiles(tech, year, coords, out_path, curve=None, batch_size=1000, height=100):
+    """ Hourly capacity factors for every (lat, lon) in coords, from the resource cache only, written as a sites x
+    8760 float32 .npy matrix (rows in coords order). Sites are converted in batches, so memory stays bounded """
+
+    columns = RESOURCES[tech][1]
+    dataset = resourceDataset(tech, height)
+    convert = (lambda speed: windCF(speed, curve)) if tech == 'wind' else solarCF
+    store = cache.openCache(dataset, year)
+
+    missing = [coord for coord in coords if coord not in store]
+    if missing:
+        raise KeyError(f'{len(missing)} sites are not in the {dataset} {year} cache, e.g. {missing[:3]}; '
+                       f'run {tech}.py for them first')
+
+    profiles = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float32, shape=(len(coords), HOURS))
+
+    for start in range(0, len(coords), batch_size):
+        block = store.matrix(coords[start:start + batch_size], columns).astype(np.float64)
+        profiles[start:start + batch_size] = toHours(convert(*(block[:, i, :] for i in range(len(columns)))))
+
+    profiles.flush()
+
+    return profiles
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    dataset = resourceDataset(args.tech, args.hub_height)
+
+    if args.sites is not None:
+        siteData = pd.read_csv(args.sites, float_precision='round_trip')
+        # Tidy cost tables have one row per site and year
+        siteData = siteData[[c for c in ('lat', 'lon', 'wtkLat', 'wtkLon') if c in siteData]].drop_duplicates()
+    else:
+        siteData = pd.DataFrame(sorted(cache.openCache(dataset, args.data_year).rows), columns=['lat', 'lon'])
+
+    # Snapped wind runs cached the WIND Toolkit cell of each site
+    cells = ['wtkLat', 'wtkLon'] if 'wtkLat' in siteData else ['lat', 'lon']
+    coords = list(zip(siteData[cells[0]].tolist(), siteData[cells[1]].tolist()))
+    curve = loadPowerCurve(args.power_curve) if args.power_curve else None
+
+    suffix = f'_{args.hub_height}m' if args.tech == 'wind' and args.hub_height != 100 else ''
+    out_path = os.path.join(local_path, f'{args.tech}_data_output/{args.tech}_cf{args.data_year}{suffix}.npy')
+    profiles = generateProfiles(args.tech, args.data_year, coords, out_path, curve, args.batch_size, args.hub_height)
+
+    siteData.to_csv(out_path.replace('.npy', '_sites.csv'), index=False)
+
+    print(f'{len(coords)} sites x {HOURS} hours --> {out_path}, mean capacity factor {profiles.mean():.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import sys
+import os
+
+if __package__:
+    from . import download, cache, sites, manifest, shards, instrument
+    from .instrument import logger
+else:  # run as a script, or imported from the repository directory
+    import download
+    import cache
+    import sites
+    import manifest
+    import shards
+    import instrument
+    from instrument import logger
+
+local_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def addArguments(parser, tech, source, grid):
+    """ Command line arguments shared by wind.py and solar.py: credentials and download options, site geometry, cost
+    years, incremental and sharded runs, output layout and grid snapping. source: e.g. 'NSRDB'; grid: native grid
+    description, e.g. 'NSRDB grid (~.04 deg)' """
+
+    download.addArguments(parser, source)
+    sites.addGeometryArguments(parser)
+    parser.add_argument('--cost_years', type=sites.yearSpan, default=None,
+                        help="ATB cost projection years, e.g. '2021-2030' or '2025,2030'. "
+                             "Default: every year in the ATB file")
+    parser.add_argument('--incremental', action='store_true',
+                        help='Reuse the previous output for sites it already has (same year, options and ATB file), '
+                             'and only fetch and compute the new sites')
+    parser.add_argument('--shard', type=shards.parseShard, default=None,
+                        help="Run one shard of the sites, e.g. '3/8', as an independent worker; merge with shards.py")
+    parser.add_argument('--shard_by', type=str, choices=['state', 'tile'], default=None,
+                        help='Split sites into work units by state or by spatial tile. Default: state for '
+                             'geometry=state')
+    parser.add_argument('--tile_deg', type=float, default=1.0,
+                        help='Tile size (degrees) for shard_by=tile, default 1.0')
+    parser.add_argument('--shard_dir', type=str, default=None,
+                        help=f'Shared work queue directory of a sharded run, default {tech}_data_output/shards')
+    parser.add_argument('--tidy', action='store_true',
+                        help='Long output: one row per site and year instead of one CAPEX/FOPEX column pair per year')
+    parser.add_argument('--snap_to_grid', action='store_true',
+                        help=f'Snap sites to the native {grid} before downloading, so sites sharing a resource cell '
+                             f'are only fetched once')
+
+
+def runParams(args, *names):
+    """ Command line options that change the per-site results (recorded by incremental and sharded runs): the
+    shared ones, plus the tech-specific options in names """
+    return {'data_year': args.data_year, 'snap_to_grid': args.snap_to_grid, 'cost_years': args.cost_years,
+            'tidy': args.tidy, **{name: getattr(args, name) for name in names}}
+
+
+def coordinates(args):
+    """ Sites of the geometry arguments, as a list of (lat, lon) tuples """
+
+    with instrument.stage('coordinates') as stage:
+        coords = sites.getCoords(args)
+        stage.rows_out = len(coords)
+    logger.debug(coords)
+    logger.info(f'{len(coords)} coordinates found...')
+
+    return coords
+
+
+def updateData(args, out_path, costs, params, inputs):
+    """ Incremental command line run: rows of the previous output are reused, costs() only runs for new sites.
+    inputs: files the per-site results depend on, besides the ATB file, sites.py and cache.py """
+
+    coords = coordinates(args)
+
+    inputs = manifest.hashFiles([sites.ATB_FILE, *inputs, sites.__file__, cache.__file__])
+
+    data, computed = manifest.updateSites(out_path, inputs, params, coords, costs, geometry=args.geometry,
+                                          states=args.states, deg_resolution=args.deg_resolution)
+    logger.info(f'{computed} new sites computed, {len(coords) - computed} reused')
+
+    return data
+
+
+def shardData(args, tech, costs, params):
+    """ Sharded command line run: this worker's work units, tracked in the run's shared work queue. Returns the
+    failed units """
+
+    siteData = sites.getSites(args)
+    shard, n_shards = args.shard
+    shard_by = args.shard_by or ('state' if args.geometry == 'state' else 'tile')
+
+    shard_dir = args.shard_dir or os.path.join(local_path, f'{tech}_data_output/shards')
+    queue = shards.WorkQueue(os.path.join(shard_dir, 'queue.sqlite'))
+    queue.plan(siteData, shards.workUnits(siteData, shard_by, args.tile_deg), n_shards, params)
+
+    return shards.runShard(queue, shard, costs)
+
+
+def run(args, tech, costs, params, inputs):
+    """ wind.py / solar.py command line run: one shard, an incremental update, or every site, written to
+    {tech}_data_output/{tech}_costs.csv. costs(coords) --> per-site DataFrame with the command line options """
+
+    out_path = os.path.join(local_path, f'{tech}_data_output/{tech}_costs.csv')
+
+    with instrument.run(args):
+        if args.shard is not None:
+            failed = shardData(args, tech, costs, params)
+            if failed:
+                sys.exit(f'Failed work units: {", ".join(failed)}; re-run the shard to retry them')
+            logger.info(f'Shard {args.shard[0]}/{args.shard[1]} done; once all shards are: '
+                        f'python shards.py --tech {tech} --merge')
+        elif args.incremental:
+            updateData(args, out_path, costs, params, inputs)
+        else:
+            data = costs(coordinates(args))
+            with instrument.stage('write', rows_in=len(data)):
+                data.to_csv(out_path, index=False)
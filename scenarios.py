@@ -0,0 +1,153 @@
+import pandas as pd
+import numpy as np
+import argparse
+import os
+
+if __package__:
+    from . import coal, instrument
+    from .instrument import logger
+else:  # run as a script, or imported from the repository directory
+    import coal
+    import instrument
+    from instrument import logger
+
+# Scenario parameters and their coal.py base values
+PARAMETERS = {'vom': coal.VOM, 'fopex': coal.FOPEX, 'unr_fuel_cost': coal.UNR_FUEL_COST}
+
+# Per-state UNR fuel cost override columns of a scenario table, e.g. 'unr_fuel_cost_PA'
+STATE_PREFIX = 'unr_fuel_cost_'
+
+
+def stateValues(value):
+    """ '--state_unr_fuel_cost' value 'PA=1.8,2.2' --> ('PA', [1.8, 2.2]) """
+
+    try:
+        state, values = value.split('=')
+        return state, [float(v) for v in values.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid state fuel costs '{value}', expected e.g. 'PA=1.8,2.2'")
+
+
+# CLI arguments
+parser = argparse.ArgumentParser(description='Coal VOPEX for every plant under many cost parameter scenarios')
+parser.add_argument('--data_year', type=int, choices=coal.DATA_YEARS, required=True,
+                    help='Year for data extraction. Must be in 2015-2020 (inclusive).')
+parser.add_argument('--scenarios', type=str, default=None,
+                    help=f'CSV with one scenario per row: columns among {", ".join(PARAMETERS)} (missing ones take '
+                         f'the coal.py value) and {STATE_PREFIX}XX per-state UNR fuel costs (empty: no override). '
+                         f'Default: the grid of the options below')
+parser.add_argument('--vom', nargs='+', type=float, default=[coal.VOM], help='VOM values ($/MWh) of the grid')
+parser.add_argument('--fopex', nargs='+', type=float, default=[coal.FOPEX], help='FOPEX values ($/MW-yr) of the grid')
+parser.add_argument('--unr_fuel_cost', nargs='+', type=float, default=[coal.UNR_FUEL_COST],
+                    help='UNR fuel cost values ($/MMBTU) of the grid')
+parser.add_argument('--state_unr_fuel_cost', nargs='+', type=stateValues, default=[],
+                    help="Per-state UNR fuel cost values of the grid, e.g. 'PA=1.8,2.2 OH=2.0'")
+parser.add_argument('--out', type=str, default=None,
+                    help='Scenario cube path, default coal_data_output/coal_scenarios{year}.npz')
+instrument.addArguments(parser)
+
+
+def scenarioGrid(vom=(coal.VOM,), fopex=(coal.FOPEX,), unr_fuel_cost=(coal.UNR_FUEL_COST,), states=None):
+    """ Every combination of the parameter values --> scenario table. states: {state: UNR fuel cost values} """
+
+    axes = {'vom': vom, 'fopex': fopex, 'unr_fuel_cost': unr_fuel_cost,
+            **{f'{STATE_PREFIX}{state}': values for state, values in (states or {}).items()}}
+
+    return pd.MultiIndex.from_product(list(axes.values()), names=list(axes)).to_frame(index=False)
+
+
+def readScenarios(path):
+    """ Scenario CSV --> scenario table, with the coal.py values for missing parameter columns """
+
+    scenarios = pd.read_csv(path)
+
+    unknown = [c for c in scenarios if c not in PARAMETERS and not c.startswith(STATE_PREFIX)]
+    if unknown:
+        raise ValueError(f'{path}: unknown scenario columns {unknown}')
+
+    return scenarios.assign(**{name: value for name, value in PARAMETERS.items() if name not in scenarios})
+
+
+def plantTable(year, data_dir=None):
+    """ Scenario-independent plant data of one year: ORIS_ID, State, Regulated, heat rate and (REG) fuel cost, in
+    coal_costs_total order """
+
+    tables = coal.computeCostTables(year, data_dir)
+    plants = pd.concat([tables['CoalCostsReg'].assign(Regulated='REG'), tables['CoalCostsUnr'].assign(Regulated='UNR')],
+                       ignore_index=True)
+
+    return plants[['ORIS_ID', 'State', 'Regulated', 'Heat_Rate_(MMBTU/MWh)', 'Avg_Fuel_Cost_($/MMBTU)']]
+
+
+def sweep(plants, scenarios):
+    """ plants x scenarios VOPEX ($/MWh) matrix, in one broadcast: UNR plants take the scenario's fuel cost for their
+    state if it has one, else its default UNR fuel cost; REG plants keep their reported fuel cost """
+
+    n_scenarios = len(scenarios)
+
+    # States with overrides --> rows of an override table (NaN: no override); other states point to an all-NaN row
+    states = [c[len(STATE_PREFIX):] for c in scenarios if c.startswith(STATE_PREFIX)]
+    overrides = np.full((len(states) + 1, n_scenarios), np.nan)
+    for i, state in enumerate(states):
+        overrides[i] = scenarios[f'{STATE_PREFIX}{state}'].to_numpy(dtype=np.float64)
+
+    row = pd.Index(states).get_indexer(plants['State'].astype(str))
+    state_cost = overrides[row]  # -1 (no override) picks the last, all-NaN row
+
+    unr_cost = np.where(np.isnan(state_cost), scenarios['unr_fuel_cost'].to_numpy(dtype=np.float64), state_cost)
+    fuel_cost = np.where((plants['Regulated'] == 'REG').to_numpy()[:, None],
+                         plants['Avg_Fuel_Cost_($/MMBTU)'].to_numpy(dtype=np.float64)[:, None], unr_cost)
+
+    return (plants['Heat_Rate_(MMBTU/MWh)'].to_numpy(dtype=np.float64)[:, None] * fuel_cost
+            + scenarios['vom'].to_numpy(dtype=np.float64))
+
+
+def writeCube(path, plants, scenarios, vopex):
+    """ Scenario cube: VOPEX (float32, plants x scenarios), the plant keys, and the scenario parameter table """
+
+    np.savez_compressed(path, vopex=vopex.astype(np.float32), oris_id=plants['ORIS_ID'].to_numpy(dtype=np.int32),
+                        state=plants['State'].to_numpy(dtype=str), regulated=plants['Regulated'].to_numpy(dtype=str),
+                        parameters=np.array(scenarios.columns, dtype=str),
+                        scenarios=scenarios.to_numpy(dtype=np.float64))
+
+
+def readCube(path):
+    """ Scenario cube --> (plants DataFrame, scenarios DataFrame, VOPEX matrix). FOPEX is per scenario only, in the
+    scenario table """
+
+    with np.load(path) as cube:
+        plants = pd.DataFrame({'ORIS_ID': cube['oris_id'], 'State': cube['state'], 'Regulated': cube['regulated']})
+        scenarios = pd.DataFrame(cube['scenarios'], columns=cube['parameters'])
+        return plants, scenarios, cube['vopex']
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    instrument.configure(args)
+
+    out_path = args.out or os.path.join(coal.coal_output, f'coal_scenarios{args.data_year}.npz')
+
+    with instrument.run(args):
+        if args.scenarios is not None:
+            scenarios = readScenarios(args.scenarios)
+        else:
+            scenarios = scenarioGrid(args.vom, args.fopex, args.unr_fuel_cost, dict(args.state_unr_fuel_cost))
+
+        with instrument.stage('plants') as stage:
+            plants = plantTable(args.data_year)
+            stage.rows_out = len(plants)
+
+        with instrument.stage('sweep', rows_in=len(scenarios)) as stage:
+            vopex = sweep(plants, scenarios)
+            stage.rows_out = vopex.size
+
+        logger.info(f'{len(plants)} plants x {len(scenarios)} scenarios in {stage.wall_s:.3f} s')
+
+        with instrument.stage('write', rows_in=vopex.size):
+            writeCube(out_path, plants, scenarios, vopex)
+
+    logger.info(f'Scenario cube: {out_path}')
+
+
+if __name__ == '__main__':
+    main()
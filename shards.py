@@ -0,0 +1,208 @@
+import pandas as pd
+import numpy as np
+import argparse
+import sqlite3
+import hashlib
+import json
+import time
+import os
+
+if __package__:
+    from . import manifest
+    from .instrument import logger
+else:  # run as a script, or imported from the repository directory
+    import manifest
+    from instrument import logger
+
+local_path = os.path.dirname(os.path.abspath(__file__))
+
+
+def parseShard(value):
+    """ '--shard' value 'i/N' --> (i, N), shards numbered 1-N """
+
+    try:
+        shard, n_shards = (int(v) for v in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', expected e.g. '1/8'")
+
+    if not 1 <= shard <= n_shards:
+        raise argparse.ArgumentTypeError(f"shard must be in 1-{n_shards}, got '{value}'")
+
+    return shard, n_shards
+
+
+def workUnits(siteData, by='state', tile_deg=1.0):
+    """ Work unit name per site: its state code, or the spatial tile (tile_deg x tile_deg degrees) it falls in """
+
+    if by == 'state':
+        if 'state' not in siteData:
+            raise ValueError("sharding by state needs geometry=state; use shard_by='tile' for grid runs")
+        return siteData['state'].astype(str).to_numpy()
+
+    # Tiles named by their south-west corner
+    lat = np.floor(siteData['lat'].to_numpy() / tile_deg) * tile_deg
+    lon = np.floor(siteData['lon'].to_numpy() / tile_deg) * tile_deg
+
+    return np.array([f'{a:g}_{b:g}' for a, b in zip(lat.round(6), lon.round(6))])
+
+
+def assignShards(sizes, n_shards):
+    """ {unit: number of sites} --> {unit: shard}: largest units first, each to the least loaded shard (ties to the
+    lower shard number), so every worker gets a similar number of sites. Deterministic for the same sites """
+
+    load = [0] * n_shards
+    shards = {}
+
+    for unit, size in sorted(sizes.items(), key=lambda item: (-item[1], item[0])):
+        shard = min(range(n_shards), key=lambda i: (load[i], i))
+        shards[unit] = shard + 1
+        load[shard] += size
+
+    return shards
+
+
+class WorkQueue:
+    """ SQLite work queue shared by the shard workers of one run.
+
+    Holds the run plan (parameters, every site in output order, and the work unit and shard it belongs to) and the
+    status of each unit. Every unit's output is written to its own CSV next to the queue file before it is marked
+    done, so a restarted worker skips finished units and redoes only the one it was on """
+
+    def __init__(self, path):
+        self.path = path
+        self.dir = os.path.dirname(path)
+        os.makedirs(self.dir, exist_ok=True)
+
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS run (signature TEXT, params TEXT, n_shards INTEGER);
+            CREATE TABLE IF NOT EXISTS sites (idx INTEGER PRIMARY KEY, lat REAL, lon REAL, unit TEXT);
+            CREATE TABLE IF NOT EXISTS units (unit TEXT PRIMARY KEY, shard INTEGER, sites INTEGER, status TEXT,
+                                              attempts INTEGER, updated REAL, error TEXT);
+        ''')
+
+    def plan(self, siteData, units, n_shards, params):
+        """ Record the run plan, or check that the existing plan is for the same sites, sharding and parameters """
+
+        params = json.dumps(params, sort_keys=True)
+
+        digest = hashlib.sha256(np.ascontiguousarray(siteData[['lat', 'lon']].to_numpy(dtype=np.float64)))
+        digest.update(f'{params}|{n_shards}|{",".join(units)}'.encode())
+        signature = digest.hexdigest()
+
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            existing = self.db.execute('SELECT signature FROM run').fetchone()
+
+            if existing is None:
+                sizes = pd.Series(units).value_counts().to_dict()
+                shards = assignShards(sizes, n_shards)
+
+                self.db.execute('INSERT INTO run VALUES (?, ?, ?)', (signature, params, n_shards))
+                self.db.executemany('INSERT INTO sites VALUES (?, ?, ?, ?)',
+                                    zip(range(len(units)), siteData['lat'].tolist(), siteData['lon'].tolist(),
+                                        units.tolist()))
+                self.db.executemany('INSERT INTO units VALUES (?, ?, ?, ?, 0, ?, NULL)',
+                                    [(unit, shards[unit], size, 'pending', time.time())
+                                     for unit, size in sizes.items()])
+
+            elif existing[0] != signature:
+                raise ValueError(f'{self.path} was planned for a different run (sites, sharding or parameters); '
+                                 f'remove it or use another --shard_dir')
+
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def units(self, shard=None, status=None):
+        query = 'SELECT unit FROM units WHERE (? IS NULL OR shard = ?) AND (? IS NULL OR status = ?) ORDER BY unit'
+        return [unit for unit, in self.db.execute(query, (shard, shard, status, status))]
+
+    def coords(self, unit=None):
+        """ (lat, lon) of a unit's sites (default: every site), in output order """
+        query = 'SELECT lat, lon FROM sites WHERE (? IS NULL OR unit = ?) ORDER BY idx'
+        return [tuple(row) for row in self.db.execute(query, (unit, unit))]
+
+    def mark(self, unit, status, error=None):
+        self.db.execute('UPDATE units SET status = ?, error = ?, updated = ?, '
+                        'attempts = attempts + (? = \'running\') WHERE unit = ?',
+                        (status, error, time.time(), status, unit))
+
+    def status(self):
+        """ Per shard: sites, and units by status """
+        return pd.read_sql_query('SELECT shard, status, COUNT(*) AS units, SUM(sites) AS sites FROM units '
+                                 'GROUP BY shard, status ORDER BY shard, status', self.db)
+
+    def unitPath(self, unit):
+        return os.path.join(self.dir, f'unit_{unit}.csv')
+
+
+def runShard(queue, shard, compute):
+    """ Run every unfinished unit of one shard: compute(coords) --> DataFrame, written to the unit's CSV. A failing
+    unit is recorded and the others still run; returns the failed units as {unit: error} """
+
+    failed = {}
+    done = set(queue.units(shard, 'done'))
+
+    for unit in queue.units(shard):
+        if unit in done:
+            continue
+
+        queue.mark(unit, 'running')
+        try:
+            data = compute(queue.coords(unit))
+        except Exception as e:
+            queue.mark(unit, 'failed', repr(e))
+            failed[unit] = e
+            logger.error(f'shard {shard}, unit {unit} failed: {e!r}')
+            continue
+
+        # Write-then-rename, so a unit's CSV is either complete or absent
+        path = queue.unitPath(unit)
+        data.to_csv(f'{path}.part', index=False)
+        os.replace(f'{path}.part', path)
+
+        queue.mark(unit, 'done')
+        logger.info(f'shard {shard}, unit {unit}: {len(data)} rows')
+
+    return failed
+
+
+def mergeShards(queue, out_path):
+    """ Assemble the final output from all unit CSVs, in the order a single-process run would write it """
+
+    done = set(queue.units(status='done'))
+    pending = [unit for unit in queue.units() if unit not in done]
+    if pending:
+        raise RuntimeError(f'{len(pending)} work units are not done yet, e.g. {pending[:5]}')
+
+    frames = [pd.read_csv(queue.unitPath(unit), float_precision='round_trip') for unit in queue.units()]
+    data = manifest.orderSites(pd.concat(frames, ignore_index=True), queue.coords())
+
+    data.to_csv(out_path, index=False)
+
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Progress and merge of sharded wind.py / solar.py runs')
+    parser.add_argument('--tech', type=str, required=True, choices=['wind', 'solar'])
+    parser.add_argument('--shard_dir', type=str, default=None,
+                        help="Directory of the run's work queue, default {tech}_data_output/shards")
+    parser.add_argument('--merge', action='store_true',
+                        help='Write {tech}_data_output/{tech}_costs.csv once every shard has finished')
+    args = parser.parse_args()
+
+    out_dir = os.path.join(local_path, f'{args.tech}_data_output')
+    queue = WorkQueue(os.path.join(args.shard_dir or os.path.join(out_dir, 'shards'), 'queue.sqlite'))
+
+    print(queue.status().to_string(index=False))
+
+    if args.merge:
+        data = mergeShards(queue, os.path.join(out_dir, f'{args.tech}_costs.csv'))
+        print(f'Merged {len(data)} rows')
+
+
+if __name__ == '__main__':
+    main()
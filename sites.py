@@ -0,0 +1,366 @@
+import pandas as pd
+import numpy as np
+import argparse
+import functools
+import geopandas as gpd
+import shapely
+import os
+
+if __package__:
+    from . import cache
+else:  # run as a script, or imported from the repository directory
+    import cache
+
+local_path = os.path.dirname(os.path.abspath(__file__))
+
+CONTINENTAL = ['AL', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'ID', 'IL',
+               'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO',
+               'MT', 'NE', 'NV', 'NH', 'NH', 'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR',
+               'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI',
+               'WY']
+
+# Approximate spacing (degrees) of the native resource grids: NSRDB PSM v3 is ~4 km, WIND Toolkit ~2 km
+NATIVE_RESOLUTION = {'nsrdb': .04, 'wtk': .02}
+
+# NWS state polygons, and the binary geometry index / precomputed state masks built from them (python sites.py)
+STATES_SHP = os.path.join(local_path, 'states/s_11au16.shp')
+STATE_INDEX = os.path.join(local_path, 'states/index/states.npz')
+MASK_DIR = os.path.join(local_path, 'states/index/')
+MASK_RESOLUTIONS = [.04, .1, .5]
+
+# NREL ATB cost projections
+ATB_FILE = os.path.join(local_path, 'ATB/ATB2021.csv')
+
+
+def axisSteps(start, stop, step):
+    """ Values start + i * step (i = 0, 1, ..), each computed from its integer index and rounded to
+    cache.COORD_DECIMALS: no rounding error accumulates along the axis (repeated `x += step` gave e.g.
+    40.120000000000005), and a value is the same in every lattice that contains it.
+
+    The number of values is that of the original `while x <= stop: x += step` loops, so grids keep the same sites.
+    Their accumulated rounding can drop stop itself (40 to 41 by .04 ends at 40.96), and it still does """
+
+    if stop < start:
+        return np.empty(0)
+
+    # add.accumulate sums sequentially, like repeated `+=`
+    n = int(np.floor((stop - start) / step)) + 2
+    n = np.count_nonzero(np.add.accumulate(np.concatenate(([start], np.full(n, step)))) <= stop)
+
+    return np.round(start + np.arange(n) * step, cache.COORD_DECIMALS) + 0.0
+
+
+def lattice(lats, lons):
+    """ Row-major (lat outer, lon inner) lattice of the given axis values, as flat arrays """
+
+    lat, lon = np.meshgrid(lats, lons, indexing='ij')
+
+    return lat.ravel(), lon.ravel()
+
+
+def gridCoords(min_lat, max_lat, min_lon, max_lon, deg_resolution):
+    """ Every point in a grid from a min lat/lon to a max lat/lon """
+
+    lat, lon = lattice(axisSteps(min_lat, max_lat, deg_resolution), axisSteps(min_lon, max_lon, deg_resolution))
+
+    return pd.DataFrame({'lat': lat, 'lon': lon})
+
+
+def shapefileSignature(shp_path=STATES_SHP):
+    """ Size and modification time of the shapefile parts, so a stale geometry index or mask set is never used """
+
+    parts = [shp_path[:-4] + ext for ext in ('.shp', '.shx', '.dbf')]
+
+    return np.array([v for p in parts for v in (os.path.getsize(p), os.stat(p).st_mtime_ns)], dtype=np.int64)
+
+
+def _fresh(path, shp_path):
+    """ Open an index/mask .npz if it exists and was built from the current shapefile, else None """
+
+    if not os.path.exists(path):
+        return None
+
+    stored = np.load(path, allow_pickle=False)
+    try:
+        current = shapefileSignature(shp_path)
+    except OSError:
+        # Shapefile not on disk (e.g. only the index was shipped): trust the index
+        return stored
+
+    return stored if np.array_equal(stored['signature'], current) else None
+
+
+def readStateIndex(index_path=STATE_INDEX, shp_path=STATES_SHP):
+    """ All state polygons from the binary geometry index (WKB), or None when it is missing or out of date """
+
+    index = _fresh(index_path, shp_path)
+    if index is None:
+        return None
+
+    wkb = index['wkb'].tobytes()
+    offsets = index['offsets']
+    geoms = shapely.from_wkb([wkb[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)])
+
+    return gpd.GeoDataFrame({'STATE': index['state']}, geometry=geoms, crs=str(index['crs']) or None)
+
+
+def loadStates(states, index_path=STATE_INDEX, shp_path=STATES_SHP):
+    """ Load state polygons (from the geometry index if built, else the NWS shapefile), subset to the requested
+    state codes """
+
+    if 'CONTINENTAL' in states:
+        states = CONTINENTAL
+
+    usShp = readStateIndex(index_path, shp_path)
+    if usShp is None:
+        usShp = gpd.read_file(shp_path)
+
+    return usShp[usShp['STATE'].isin(states)].reset_index(drop=True)
+
+
+def maskKey(states):
+    """ Requested state codes --> name of their precomputed mask ('CONTINENTAL', or sorted codes joined by '+') """
+
+    if 'CONTINENTAL' in states:
+        return 'CONTINENTAL'
+
+    return '+'.join(sorted(set(states)))
+
+
+def maskPath(deg_resolution, mask_dir=MASK_DIR):
+    return os.path.join(mask_dir, f'mask_{deg_resolution:g}.npz')
+
+
+def stateLattice(statesShp, deg_resolution):
+    """ Lattice covering the (rounded) bounding box of the given state polygons """
+
+    bounds = statesShp.total_bounds
+
+    min_lon = round(bounds[0], 2)
+    min_lat = round(bounds[1], 2)
+    max_lon = round(bounds[2], 2)
+    max_lat = round(bounds[3], 2)
+
+    return lattice(axisSteps(min_lat, max_lat, deg_resolution), axisSteps(min_lon, max_lon, deg_resolution))
+
+
+def pointOwners(statesShp, lat, lon):
+    """ Index of the state polygon containing each point (first match), -1 outside every polygon """
+
+    owner = np.full(lat.shape, -1, dtype=np.int16)
+
+    # One bulk point-in-polygon test per state: bounding box pre-filter, then prepared contains over all candidates
+    for i, geom in enumerate(statesShp.geometry.values):
+        g_min_lon, g_min_lat, g_max_lon, g_max_lat = geom.bounds
+        candidates = np.flatnonzero((owner < 0) & (lon >= g_min_lon) & (lon <= g_max_lon)
+                                    & (lat >= g_min_lat) & (lat <= g_max_lat))
+        if len(candidates) == 0:
+            continue
+
+        shapely.prepare(geom)
+        owner[candidates[shapely.contains_xy(geom, lon[candidates], lat[candidates])]] = i
+
+    return owner
+
+
+def readMask(states, deg_resolution, size, mask_dir=MASK_DIR, shp_path=STATES_SHP):
+    """ Precomputed owner array for exactly this state selection and resolution, or None """
+
+    masks = _fresh(maskPath(deg_resolution, mask_dir), shp_path)
+    key = maskKey(states)
+
+    if masks is None or key not in masks.files or len(masks[key]) != size:
+        return None
+
+    return masks[key]
+
+
+def stateCoords(states, deg_resolution, index_path=STATE_INDEX, mask_dir=MASK_DIR, shp_path=STATES_SHP):
+    """ Grid bounded by one or multiple states --> lattice points inside the state polygons, tagged by state.
+    Selections with a precomputed mask skip the point-in-polygon tests """
+
+    statesShp = loadStates(states, index_path, shp_path)
+
+    lat, lon = stateLattice(statesShp, deg_resolution)
+
+    owner = readMask(states, deg_resolution, len(lat), mask_dir, shp_path)
+    if owner is None:
+        owner = pointOwners(statesShp, lat, lon)
+
+    mask = owner >= 0
+
+    return pd.DataFrame({'lat': lat[mask], 'lon': lon[mask], 'state': statesShp['STATE'].values[owner[mask]]})
+
+
+def buildStateIndex(resolutions=MASK_RESOLUTIONS, index_path=STATE_INDEX, mask_dir=MASK_DIR, shp_path=STATES_SHP):
+    """ One-time build: state polygons as WKB, plus owner masks for every single state and CONTINENTAL at each
+    resolution. Rebuild whenever the shapefile changes (stale files are ignored) """
+
+    usShp = gpd.read_file(shp_path)
+    signature = shapefileSignature(shp_path)
+
+    wkb = [shapely.to_wkb(geom) for geom in usShp.geometry.values]
+    offsets = np.concatenate(([0], np.cumsum([len(w) for w in wkb])))
+
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    np.savez(index_path, signature=signature, state=usShp['STATE'].to_numpy(dtype=str),
+             wkb=np.frombuffer(b''.join(wkb), dtype=np.uint8), offsets=offsets,
+             crs=usShp.crs.to_wkt() if usShp.crs else '')
+
+    os.makedirs(mask_dir, exist_ok=True)
+    selections = [[state] for state in sorted(set(usShp['STATE']))] + [['CONTINENTAL']]
+
+    for deg_resolution in resolutions:
+        masks = {}
+        for states in selections:
+            statesShp = loadStates(states, index_path, shp_path)
+            if statesShp.empty:
+                continue
+            lat, lon = stateLattice(statesShp, deg_resolution)
+            masks[maskKey(states)] = pointOwners(statesShp, lat, lon)
+
+        np.savez_compressed(maskPath(deg_resolution, mask_dir), signature=signature, **masks)
+
+    return len(usShp), len(selections)
+
+
+def coordList(coords):
+    """ DataFrame of sites --> list of (lat, lon) tuples, as consumed by mergeData() """
+
+    return list(zip(coords['lat'].tolist(), coords['lon'].tolist()))
+
+
+def snapCoords(coords, resolution):
+    """ Snap requested (lat, lon) points onto a lattice at the native resource grid spacing, so points that resolve
+    to the same resource cell are fetched once. Returns the unique cells as (lat, lon) tuples, and the index of
+    each requested point's cell """
+
+    points = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    snapped = np.round(np.round(points / resolution) * resolution, cache.COORD_DECIMALS) + 0.0
+
+    cells, inverse = np.unique(snapped, axis=0, return_inverse=True)
+
+    return [tuple(cell) for cell in cells.tolist()], inverse.ravel()
+
+
+def fanOut(cellData, coords, inverse, cell_columns=()):
+    """ Per-cell results --> one row per requested point. The requested lat/lon replace the cell's, which can be
+    kept under the names in cell_columns (e.g. ('wtkLat', 'wtkLon')) """
+
+    data = cellData.iloc[inverse].reset_index(drop=True)
+
+    for i, (name, column) in enumerate(zip(cell_columns, ['lat', 'lon'])):
+        data.insert(2 + i, name, data[column])
+
+    data['lat'] = [lat for lat, lon in coords]
+    data['lon'] = [lon for lat, lon in coords]
+
+    return data
+
+
+@functools.lru_cache(maxsize=None)
+def readAtb(path=ATB_FILE):
+    """ ATB file, parsed once per process (callers must not modify it) """
+    return pd.read_csv(path)
+
+
+def getAtbCosts(tech):
+    """Load NREL ATB data for access to future cost projections (2021-2035), for one technology in the ATB file"""
+
+    atb = readAtb(ATB_FILE)
+
+    tech_atb = atb[['TECH', 'YEAR', 'CAPEX_($/MW)', 'FOPEX_($/MW)']]
+
+    tech_atb = tech_atb[tech_atb['TECH'] == tech]
+    if tech_atb.empty:
+        raise ValueError(f"No '{tech}' rows in {ATB_FILE}")
+    del tech_atb['TECH']
+
+    convert_dict = {'YEAR': int,
+                    'CAPEX_($/MW)': float,
+                    'FOPEX_($/MW)': float
+                    }
+
+    return tech_atb.astype(convert_dict).reset_index(drop=True)
+
+
+def projectCosts(siteData, atb, years=None, tidy=False):
+    """ Attach ATB CAPEX/FOPEX projections to every site in one operation.
+
+    Wide (default): one CAPEX_($/MW)_{year} and FOPEX_($/MW)_{year} column pair per year. tidy=True: one row per
+    site and year, with YEAR, CAPEX_($/MW) and FOPEX_($/MW) columns. years defaults to every year in the ATB table """
+
+    atb = atb.set_index('YEAR')
+    years = atb.index.tolist() if years is None else list(years)
+
+    missing = [y for y in years if y not in atb.index]
+    if missing:
+        raise ValueError(f'No ATB cost projections for {missing}; available years: {atb.index.tolist()}')
+
+    costs = atb.loc[years, ['CAPEX_($/MW)', 'FOPEX_($/MW)']]
+
+    if tidy:
+        return siteData.merge(costs.reset_index(), how='cross')
+
+    # Row-major ravel interleaves CAPEX/FOPEX per year, matching the original column order
+    names = [f'{column}_{year}' for year in years for column in costs.columns]
+    block = pd.DataFrame(np.tile(costs.to_numpy().ravel(), (len(siteData), 1)), columns=names, index=siteData.index)
+
+    return pd.concat([siteData, block], axis=1)
+
+
+def yearSpan(value):
+    """ Command line year range: '2021-2030', or a comma separated list like '2025,2030' """
+
+    try:
+        if '-' in value:
+            first, last = (int(v) for v in value.split('-'))
+            return list(range(first, last + 1))
+        return [int(v) for v in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid year range '{value}'")
+
+
+def addGeometryArguments(parser):
+    """ Site selection options shared by the command line tools """
+
+    parser.add_argument('--geometry', type=str, help='Option for choosing sites.', choices=['grid', 'state'],
+                        required=True)
+    parser.add_argument('--min_lat', type=float, help='Required if geometry=grid')
+    parser.add_argument('--max_lat', type=float, help='Required if geometry=grid')
+    parser.add_argument('--min_lon', type=float, help='Required if geometry=grid')
+    parser.add_argument('--max_lon', type=float, help='Required if geometry=grid')
+    parser.add_argument('--states', nargs='+', type=str,
+                        help="Required if geometry=state, e.g. 'PA OH NY'.. Input == 'CONTINENTAL' for entire US.")
+    parser.add_argument('--deg_resolution', type=float, default=.04,
+                        help='Approximate resolution of coordinate grid. Used for geometry=state or geometry=grid, '
+                             'default .04')
+
+
+def getSites(args):
+    """ Command line geometry arguments (grid bounds or states, and resolution) --> DataFrame of sites (lat, lon, and
+    state for geometry=state) """
+
+    if args.geometry == 'grid':
+        return gridCoords(args.min_lat, args.max_lat, args.min_lon, args.max_lon, args.deg_resolution)
+
+    return stateCoords(args.states, args.deg_resolution)
+
+
+def getCoords(args):  # Source code from ijbd (GitHub user)
+    """ Command line geometry arguments (grid bounds or states, and resolution) --> list of (lat, lon) tuples """
+    return coordList(getSites(args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the state geometry index and precomputed state masks')
+    parser.add_argument('--resolutions', nargs='+', type=float, default=MASK_RESOLUTIONS,
+                        help='Lat/lon resolutions (in degrees) to precompute state masks for. Default: .04 .1 .5')
+    args = parser.parse_args()
+
+    n_polygons, n_masks = buildStateIndex(args.resolutions)
+    print(f'Indexed {n_polygons} state polygons, {n_masks} masks per resolution, in {MASK_DIR}')
+
+
+if __name__ == '__main__':
+    main()
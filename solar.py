@@ -1,210 +1,184 @@
 import pandas as pd
 import argparse
-import geopandas as gpd
-from shapely.geometry import Point
 import os
 
+if __package__:
+    from . import download, cache, sites, runner, instrument
+    from .instrument import logger
+else:  # run as a script, or imported from the repository directory
+    import download
+    import cache
+    import sites
+    import runner
+    import instrument
+    from instrument import logger
+
 local_path = os.path.dirname(os.path.abspath(__file__))
 
+# Resource cache dataset for NSRDB PSM v3 data
+NSRDB_DATASET = 'nsrdb'
+
+# NSRDB PSM v3 download endpoint
+NSRDB_URL = 'https://developer.nrel.gov/api/nsrdb/v2/solar/psm3-download.csv'
+
+# NSRDB header fields kept in the metadata index: actual grid cell location, and elevation
+NSRDB_META_FIELDS = ['Latitude', 'Longitude', 'Elevation']
+
 # CLI arguments
 parser = argparse.ArgumentParser(description='Command line arguments for data extraction and cost calculations')
 parser.add_argument('--data_year', type=int, choices=[2016, 2017, 2018, 2019, 2020],
                     help='Year of data extraction. Must '
                          'be in 2016-2020 (inclusive).',
                     required=True)
-parser.add_argument('--api_key', type=str, help='NREL API Key. Sign up @ https://developer.nrel.gov/signup/',
-                    required=True)
-parser.add_argument('--email', type=str, help='Email address.', required=True)
-parser.add_argument('--geometry', type=str, help='Option for choosing sites.', choices=['grid', 'state'], required=True)
-parser.add_argument('--min_lat', type=float, help='Required if geometry=grid')
-parser.add_argument('--max_lat', type=float, help='Required if geometry=grid')
-parser.add_argument('--min_lon', type=float, help='Required if geometry=grid')
-parser.add_argument('--max_lon', type=float, help='Required if geometry=grid')
-parser.add_argument('--states', nargs='+', type=str,
-                    help="Required if geometry=state, e.g. 'PA OH NY'.. Input == 'CONTINENTAL' for entire US.")
-parser.add_argument('--deg_resolution', type=float, default=.04, help='Approximate resolution of coordinate grid. '
-                                                                      'Used for geometry=state or geometry=grid,'
-                                                                      'default .04')
-
-args = parser.parse_args()
-
-
-def getCoords():  # Source code from ijbd (GitHub user)
-    if args.geometry == 'grid':
-        coordinates = []
-
-        lat = args.min_lat
-        while lat <= args.max_lat:
-            lon = args.min_lon
-            while lon <= args.max_lon:
-                coordinates.append((lat, lon))
-                lon += args.deg_resolution
-            lat += args.deg_resolution
-        return coordinates
-
-    states = args.states
-    if 'CONTINENTAL' in args.states:
-        states = ['AL', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'ID', 'IL',
-                  'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO',
-                  'MT', 'NE', 'NV', 'NH', 'NH', 'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR',
-                  'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI',
-                  'WY']
-
-    # get outer bounds
-    usShp = gpd.read_file(os.path.join(local_path, 'states/s_11au16.shp'))
-    statesShp = usShp[usShp['STATE'].isin(states)]
-
-    coordinates = []
-
-    bounds = statesShp.total_bounds
-
-    min_lon = round(bounds[0], 2)
-    min_lat = round(bounds[1], 2)
-    max_lon = round(bounds[2], 2)
-    max_lat = round(bounds[3], 2)
-
-    lat = min_lat
-
-    while lat <= max_lat:
-        lon = min_lon
-        while lon <= max_lon:
-            if statesShp.contains(Point(lon, lat)).any():
-                coordinates.append((lat, lon))
-            lon += args.deg_resolution
-        lat += args.deg_resolution
-
-    return coordinates
-
-
-def getSolarData(year, lat, lon):  # Source code from ijbd (GitHub user)
-
-    solarCSV = os.path.join(local_path, f'solar_data_output/{lat}_{lon}_nsrdb.csv')
-
-    if not os.path.exists(solarCSV):
-        nsrdb_url = 'https://developer.nrel.gov/api/nsrdb/v2/solar/psm3-download.csv'
-
-        params = {'api_key': args.api_key,
-                  'email': args.email,
-                  'wkt': f'POINT({lon}+{lat})',
-                  'names': year,
-                  'utc': 'true'
-                  }
-
-        params_str = '&'.join([f'{key}={params[key]}' for key in params])
-        download_url = f'{nsrdb_url}?{params_str}'
-        print(download_url)
-
-        # Save resource CSV files
-        solarResource = pd.read_csv(download_url)
-        solarResource.to_csv(solarCSV, index=False)
-
-    solarResourceDescription = pd.read_csv(solarCSV)
-    solarResourceDescription = solarResourceDescription.head(1)
-    # Check actual NSRDB lat/lon
-    nsrdbLat = solarResourceDescription.at[0, 'Latitude']
-    nsrdbLon = solarResourceDescription.at[0, 'Longitude']
-    elevation = solarResourceDescription.at[0, 'Elevation']
+runner.addArguments(parser, 'solar', 'NSRDB', 'NSRDB grid (~.04 deg)')
+instrument.addArguments(parser)
 
-    return lat, lon, nsrdbLat, nsrdbLon, elevation
 
+def solarURL(year, lat, lon, api_key, email):
+    """ NSRDB (PSM v3) download url for one coordinate """
 
-def getSolarCosts():
-    """Load NREL ATB data for access to future cost projections (2021-2035)"""
+    params = {'api_key': api_key,
+              'email': email,
+              'wkt': f'POINT({lon}+{lat})',
+              'names': year,
+              'utc': 'true'
+              }
 
-    atb_path = os.path.join(local_path, 'ATB/ATB2021.csv')
-    atb = pd.read_csv(atb_path)
+    params_str = '&'.join([f'{key}={params[key]}' for key in params])
 
-    sol_atb = atb[['TECH', 'YEAR', 'CAPEX_($/MW)', 'FOPEX_($/MW)']]
+    return f'{NSRDB_URL}?{params_str}'
 
-    sol_atb = sol_atb[sol_atb['TECH'] == 'Solar']
-    del sol_atb['TECH']
 
-    convert_dict = {'YEAR': int,
-                    'CAPEX_($/MW)': float,
-                    'FOPEX_($/MW)': float
-                    }
+def storeSolarData(store, lat, lon, content):
+    """ Parse a downloaded PSM v3 file and add it to the resource cache """
+    meta, frame = cache.readPSM3(content)
+    store.put(lat, lon, frame, meta)
 
-    sol_atb = sol_atb.astype(convert_dict).reset_index(drop=True)
 
-    print(sol_atb)
-    print(sol_atb.dtypes)
+def indexSolarMeta(index, year, lat, lon, meta):
+    """ Record a site's NSRDB grid cell and elevation in the metadata index """
+    values = tuple(meta[field] for field in NSRDB_META_FIELDS)
+    index.put(lat, lon, year, values)
+    return values
 
-    return sol_atb
 
+def downloadSolarData(year, coords, api_key, email, workers=4, rate=1.0, retries=5):
+    """ Concurrently download NSRDB data for every coordinate that is not cached yet. Sites already in the metadata
+    index are skipped without opening the resource cache """
 
-def mergeData():
-    year = args.data_year
-    timespan = range(2021, 2031)
+    index = cache.openMetaIndex(NSRDB_DATASET, NSRDB_META_FIELDS)
 
-    sol_atb = getSolarCosts()
+    # Requested once per canonical site, so the urls (and archive keys) are stable too
+    coords = list(dict.fromkeys(cache.siteKey(lat, lon) for lat, lon in coords))
+
+    unindexed = [(lat, lon) for lat, lon in coords if index.get(lat, lon, year) is None]
+    instrument.count('meta_index_hits', len(coords) - len(unindexed))
+    if not unindexed:
+        return 0
+
+    store = cache.openCache(NSRDB_DATASET, year)
+
+    # Sites cached by other shard workers since the cache was opened
+    store.refresh()
+    missing = [(lat, lon) for lat, lon in unindexed if (lat, lon) not in store]
+
+    instrument.count('cache_hits', len(unindexed) - len(missing))
+    instrument.count('downloads', len(missing))
+
+    def save(i, content):
+        lat, lon = missing[i]
+        storeSolarData(store, lat, lon, content)
 
-    print(getCoords())
-    coords = getCoords()
-    print(f'{len(coords)} coordinates found...')
+    download.fetchAll([solarURL(year, lat, lon, api_key, email) for lat, lon in missing], save,
+                      workers=workers, rate=rate, retries=retries)
 
-    data = []
-    for i in range(len(coords)):
-        lat = coords[i][0]
-        lon = coords[i][1]
+    return len(missing)
 
-        data.append(getSolarData(year, lat, lon))
 
-    solarCosts = pd.DataFrame(data, columns=('lat', 'lon', 'nsrdbLat', 'nsrdbLon', 'elevation'))
+def getSolarData(year, lat, lon, api_key=None, email=None, retries=5):  # Source code from ijbd (GitHub user)
 
-    for y in timespan:
-        if y == 2021:
-            solarCosts.loc[:, 'CAPEX_($/MW)_2021'] = sol_atb.iloc[0]['CAPEX_($/MW)']
-            solarCosts.loc[:, 'FOPEX_($/MW)_2021'] = sol_atb.iloc[0]['FOPEX_($/MW)']
+    # Check actual NSRDB lat/lon, from the metadata index when this site has been seen before
+    index = cache.openMetaIndex(NSRDB_DATASET, NSRDB_META_FIELDS)
+    solarResourceDescription = index.get(lat, lon, year)
 
-        elif y == 2022:
-            solarCosts.loc[:, 'CAPEX_($/MW)_2022'] = sol_atb.iloc[1]['CAPEX_($/MW)']
-            solarCosts.loc[:, 'FOPEX_($/MW)_2022'] = sol_atb.iloc[1]['FOPEX_($/MW)']
+    if solarResourceDescription is None:
+        store = cache.openCache(NSRDB_DATASET, year)
 
-        elif y == 2023:
-            solarCosts.loc[:, 'CAPEX_($/MW)_2023'] = sol_atb.iloc[2]['CAPEX_($/MW)']
-            solarCosts.loc[:, 'FOPEX_($/MW)_2023'] = sol_atb.iloc[2]['FOPEX_($/MW)']
+        if (lat, lon) not in store:
+            download_url = solarURL(year, lat, lon, api_key, email)
 
-        elif y == 2024:
-            solarCosts.loc[:, 'CAPEX_($/MW)_2024'] = sol_atb.iloc[3]['CAPEX_($/MW)']
-            solarCosts.loc[:, 'FOPEX_($/MW)_2024'] = sol_atb.iloc[3]['FOPEX_($/MW)']
+            # Save resource data to the cache
+            storeSolarData(store, lat, lon, download.fetchUrl(download_url, retries=retries))
 
-        elif y == 2025:
-            solarCosts.loc[:, 'CAPEX_($/MW)_2025'] = sol_atb.iloc[4]['CAPEX_($/MW)']
-            solarCosts.loc[:, 'FOPEX_($/MW)_2025'] = sol_atb.iloc[4]['FOPEX_($/MW)']
+        solarResourceDescription = indexSolarMeta(index, year, lat, lon, store.meta(lat, lon))
 
-        elif y == 2026:
-            solarCosts.loc[:, 'CAPEX_($/MW)_2026'] = sol_atb.iloc[5]['CAPEX_($/MW)']
-            solarCosts.loc[:, 'FOPEX_($/MW)_2026'] = sol_atb.iloc[5]['FOPEX_($/MW)']
+    nsrdbLat, nsrdbLon, elevation = solarResourceDescription
 
-        elif y == 2027:
-            solarCosts.loc[:, 'CAPEX_($/MW)_2027'] = sol_atb.iloc[6]['CAPEX_($/MW)']
-            solarCosts.loc[:, 'FOPEX_($/MW)_2027'] = sol_atb.iloc[6]['FOPEX_($/MW)']
+    return lat, lon, nsrdbLat, nsrdbLon, elevation
+
+
+def getSolarCosts():
+    """Load NREL ATB data for access to future cost projections (2021-2035)"""
+    return sites.getAtbCosts('Solar')
+
+
+def siteCosts(coords, year, api_key, email, workers=4, rate=1.0, retries=5, snap=False, cost_years=None, tidy=False):
+    """ Solar resource and ATB cost projections for a list of (lat, lon) coordinates, as a DataFrame. Resource data
+    that is not cached yet is downloaded with the given credentials; nothing is printed or written to the outputs.
+    cost_years selects the ATB projection years (default: all in the ATB file), tidy=True returns one row per site
+    and year instead of one cost column pair per year. snap=True fetches each native grid cell once and fans its
+    results out to every requested point in it """
 
-        elif y == 2028:
-            solarCosts.loc[:, 'CAPEX_($/MW)_2028'] = sol_atb.iloc[7]['CAPEX_($/MW)']
-            solarCosts.loc[:, 'FOPEX_($/MW)_2028'] = sol_atb.iloc[7]['FOPEX_($/MW)']
+    sol_atb = getSolarCosts()
+
+    # Optionally resolve requested points to unique native grid cells first
+    cells, inverse = sites.snapCoords(coords, sites.NATIVE_RESOLUTION['nsrdb']) if snap else (coords, None)
+
+    with instrument.stage('download', rows_in=len(cells)) as stage:
+        stage.rows_out = downloadSolarData(year, cells, api_key, email, workers, rate, retries)
+
+    with instrument.stage('summarize', rows_in=len(cells)) as stage:
+        progress = instrument.Progress(len(cells), 'sites')
+        data = []
+        for i in range(len(cells)):
+            lat = cells[i][0]
+            lon = cells[i][1]
 
-        elif y == 2029:
-            solarCosts.loc[:, 'CAPEX_($/MW)_2029'] = sol_atb.iloc[8]['CAPEX_($/MW)']
-            solarCosts.loc[:, 'FOPEX_($/MW)_2029'] = sol_atb.iloc[8]['FOPEX_($/MW)']
+            data.append(getSolarData(year, lat, lon, api_key, email, retries))
+            progress.update()
 
-        else:
-            solarCosts.loc[:, 'CAPEX_($/MW)_2030'] = sol_atb.iloc[9]['CAPEX_($/MW)']
-            solarCosts.loc[:, 'FOPEX_($/MW)_2030'] = sol_atb.iloc[9]['FOPEX_($/MW)']
+        solarCosts = pd.DataFrame(data, columns=('lat', 'lon', 'nsrdbLat', 'nsrdbLon', 'elevation'))
+        stage.rows_out = len(solarCosts)
+
+    with instrument.stage('costs', rows_in=len(solarCosts)) as stage:
+        if inverse is not None:
+            solarCosts = sites.fanOut(solarCosts, coords, inverse)
+
+        solarCosts = sites.projectCosts(solarCosts, sol_atb, cost_years, tidy)
+        stage.rows_out = len(solarCosts)
 
     return solarCosts
 
 
-def main():
-    print(f'local path: {local_path}')  # quick check
+def argsCosts(args, coords):
+    """ siteCosts() with the command line options """
+    return siteCosts(coords, args.data_year, args.api_key, args.email, workers=args.workers,
+                     rate=args.requests_per_second, retries=args.retries, snap=args.snap_to_grid,
+                     cost_years=args.cost_years, tidy=args.tidy)
+
 
-    solarCosts = mergeData()
+def main(argv=None):
+    args = parser.parse_args(argv)
+    instrument.configure(args)
+    download.configure(args)
 
-    out_path = os.path.join(local_path, 'solar_data_output/solar_costs.csv')
+    logger.debug(f'local path: {local_path}')  # quick check
+    logger.debug(getSolarCosts())
 
-    solarCosts.to_csv(out_path, index=False)
+    runner.run(args, 'solar', lambda coords: argsCosts(args, coords), runner.runParams(args),
+               [os.path.abspath(__file__)])
 
-    print('Fin')
+    logger.info('Fin')
 
 
 if __name__ == '__main__':
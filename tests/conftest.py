@@ -0,0 +1,5 @@
+import sys
+import os
+
+# The modules are imported flat, as when run from the repository directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,163 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cache
+
+HOURS = 24
+
+
+@pytest.fixture
+def root(tmp_path):
+    return str(tmp_path)
+
+
+def series(seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'Speed': rng.uniform(0, 20, HOURS), 'Direction': rng.uniform(0, 360, HOURS)},
+                        dtype=np.float32)
+
+
+def fill(root, n):
+    """ Cache with n sites; returns it and the sites """
+
+    store = cache.ResourceCache('wtk_100m', 2012, root)
+    coords = [(40 + i / 10, -80 - i / 10) for i in range(n)]
+    for i, (lat, lon) in enumerate(coords):
+        store.put(lat, lon, series(i), {'site': i})
+
+    return store, coords
+
+
+def path(store, name):
+    return os.path.join(store.path, name)
+
+
+def append(store, name, content):
+    with open(path(store, name), 'ab') as f:
+        f.write(content)
+
+
+def assertIntact(root, coords):
+    """ A fresh open (as in a new process) finds every site with its own values and metadata """
+
+    store = cache.ResourceCache('wtk_100m', 2012, root)
+
+    assert len(store) == len(coords)
+    matrix = store.matrix(coords, ['Speed', 'Direction'])
+    for i, (lat, lon) in enumerate(coords):
+        np.testing.assert_array_equal(matrix[i].T, series(i).to_numpy())
+        assert store.meta(lat, lon) == {'site': i}
+
+    assert os.path.getsize(path(store, 'keys.f64')) == len(coords) * 16
+    assert os.path.getsize(path(store, 'data.f32')) == len(coords) * store._rowBytes()
+    with open(path(store, 'meta.jsonl'), 'rb') as f:
+        assert f.read().count(b'\n') == len(coords)
+
+    return store
+
+
+def reopenAndPut(root, coords):
+    """ Reopen an interrupted cache, add one more site, and check the cache on a second open """
+
+    store = cache.ResourceCache('wtk_100m', 2012, root)
+    assert len(store) == len(coords)
+
+    lat, lon = 41.0, -81.0
+    store.put(lat, lon, series(len(coords)), {'site': len(coords)})
+
+    assertIntact(root, coords + [(lat, lon)])
+
+
+def test_partial_data_row(root):
+    store, coords = fill(root, 3)
+    append(store, 'data.f32', b'\0' * (store._rowBytes() // 2))
+
+    reopenAndPut(root, coords)
+
+
+def test_partial_meta_line(root):
+    # The crashed put() wrote its data row and part of its metadata, but no key: the complete line count still
+    # equals the key count
+    store, coords = fill(root, 3)
+    append(store, 'data.f32', series(9).to_numpy().T.tobytes())
+    append(store, 'meta.jsonl', b'{"si')
+
+    reopenAndPut(root, coords)
+
+
+def test_meta_written_onto_partial_line(root):
+    # Left by versions that did not trim partial metadata lines: the next line was appended onto the partial one
+    store, coords = fill(root, 3)
+    append(store, 'meta.jsonl', b'{"si{"site": 3}\n')
+
+    reopenAndPut(root, coords)
+
+
+@pytest.mark.parametrize('complete', ['keys.f64', 'data.f32', 'meta.jsonl'])
+def test_length_mismatch(root, complete):
+    # A put() interrupted after writing only one of the three files
+    store, coords = fill(root, 3)
+    content = {'keys.f64': np.array([41.5, -81.5]).tobytes(),
+               'data.f32': series(9).to_numpy().T.tobytes(),
+               'meta.jsonl': b'{"site": 9}\n'}[complete]
+    append(store, complete, content)
+
+    reopenAndPut(root, coords)
+
+
+def test_refresh_picks_up_other_writers(root):
+    store, coords = fill(root, 2)
+    other = cache.ResourceCache('wtk_100m', 2012, root)
+    other.put(41.0, -81.0, series(2), {'site': 2})
+
+    assert (41.0, -81.0) not in store
+    store.refresh()
+    assert (41.0, -81.0) in store
+    np.testing.assert_array_equal(store.matrix([(41.0, -81.0)], ['Speed'])[0, 0], series(2)['Speed'].to_numpy())
+
+
+def test_refresh_on_new_cache(root):
+    # The cache did not exist yet when it was opened here
+    store = cache.ResourceCache('wtk_100m', 2012, root)
+    fill(root, 2)
+
+    store.refresh()
+    assert len(store) == 2
+
+
+def test_layout_mismatch(root):
+    store, _ = fill(root, 1)
+
+    with pytest.raises(ValueError):
+        store.put(41.0, -81.0, series(1)[['Speed']])
+
+
+@pytest.mark.skipif(cache.fcntl is None, reason='no fcntl')
+def test_file_lock_is_exclusive(root):
+    lock = os.path.join(root, '.lock')
+
+    with cache.fileLock(lock):
+        with open(lock, 'a') as f:
+            with pytest.raises(BlockingIOError):
+                cache.fcntl.flock(f, cache.fcntl.LOCK_EX | cache.fcntl.LOCK_NB)
+
+    with open(lock, 'a') as f:
+        cache.fcntl.flock(f, cache.fcntl.LOCK_EX | cache.fcntl.LOCK_NB)
+
+
+def test_site_key():
+    assert cache.siteKey(40.1 + 1e-9, -80.2 - 1e-9) == (40.1, -80.2)
+    assert cache.siteKey(0.1 + 0.2, 0.3) == (0.3, 0.3)
+    assert str(cache.siteKey(-1e-9, -0.0)) == '(0.0, 0.0)'
+    assert all(type(value) is float for value in cache.siteKey(np.float32(40.5), np.int64(-80)))
+
+
+def test_site_key_lookups(root):
+    store, _ = fill(root, 1)
+
+    assert (40 + 1e-9, -80.0) in store
+    assert (np.float32(40.0), np.float64(-80.0)) in store
+    assert store.meta(40.0000004, -79.9999996) == {'site': 0}
@@ -0,0 +1,118 @@
+import urllib.error
+import time
+
+import pytest
+
+import download
+import instrument
+import fixtures
+import cache
+import wind
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """ Local stub of the NREL API, with a fresh transport so no connections are shared between tests """
+
+    monkeypatch.setattr(download, 'transport', download.LiveTransport())
+    with fixtures.StubServer() as server:
+        yield server
+
+
+def srwUrl(stub, lat, lon):
+    return f'{stub.wtk_url}?lat={lat}&lon={lon}&hubheight=100&year=2012'
+
+
+def retries():
+    return instrument.report.counters.get('http_retries', 0)
+
+
+def test_fetch_all_keeps_input_order(stub):
+    stub.jitter = 0.05
+    coords = [(40 + i / 10, -80 - i / 10) for i in range(12)]
+    calls = []
+
+    def handler(i, content):
+        calls.append(i)
+        return content
+
+    results = download.fetchAll([srwUrl(stub, lat, lon) for lat, lon in coords], handler, workers=4, rate=1000)
+
+    assert sorted(calls) == list(range(len(coords)))
+    assert results == [fixtures.srwFile(lat, lon, 100) for lat, lon in coords]
+
+
+@pytest.mark.parametrize('statuses', [[429], [503], [429, 500, 502, 504]])
+def test_fetch_url_retries_rate_limits_and_server_errors(stub, statuses):
+    stub.fail(statuses)
+    before = retries()
+
+    content = download.fetchUrl(srwUrl(stub, 40.0, -80.0), retries=5, backoff=0.01)
+
+    assert content == fixtures.srwFile(40.0, -80.0, 100)
+    assert (stub.failed, stub.requests) == (len(statuses), 1)
+    assert retries() - before == len(statuses)
+
+
+def test_fetch_url_gives_up_after_retries(stub):
+    stub.fail([503] * 3)
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        download.fetchUrl(srwUrl(stub, 40.0, -80.0), retries=2, backoff=0.01)
+
+    assert error.value.code == 503
+    assert (stub.failed, stub.requests) == (3, 0)
+
+
+def test_fetch_url_does_not_retry_client_errors(stub):
+    stub.fail([404, 404])
+
+    with pytest.raises(urllib.error.HTTPError):
+        download.fetchUrl(srwUrl(stub, 40.0, -80.0), retries=5, backoff=0.01)
+
+    assert stub.failed == 1
+
+
+def test_fetch_url_honours_retry_after(stub):
+    stub.fail([429], retry_after=1)
+
+    start = time.perf_counter()
+    download.fetchUrl(srwUrl(stub, 40.0, -80.0), retries=5, backoff=0.01)
+
+    assert time.perf_counter() - start >= 1.0
+    assert stub.requests == 1
+
+
+def test_token_bucket_caps_rate():
+    bucket = download.TokenBucket(rate=20)
+
+    start = time.perf_counter()
+    for _ in range(11):
+        bucket.acquire()
+
+    # The first request uses the initial token, the other 10 wait 1/20 s each
+    assert time.perf_counter() - start >= 10 / 20 * 0.95
+
+
+def test_fetch_all_shares_rate_limit_between_workers(stub):
+    urls = [srwUrl(stub, 40.0, -80 - i / 10) for i in range(6)]
+
+    start = time.perf_counter()
+    download.fetchAll(urls, lambda i, content: None, workers=4, rate=10)
+
+    assert time.perf_counter() - start >= 5 / 10 * 0.95
+    assert stub.requests == len(urls)
+
+
+def test_rerun_skips_cached_sites(stub, monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, 'cache_root', str(tmp_path))
+    monkeypatch.setattr(wind, 'WTK_URL', stub.wtk_url)
+    coords = [(40.0, -80.0), (40.1, -80.1), (40.2, -80.2)]
+
+    assert wind.downloadWindData(2012, coords, 'key', 'email', rate=1000) == len(coords)
+    assert stub.requests == len(coords)
+
+    # A new process: the cache is reopened from disk
+    monkeypatch.setattr(cache, '_open_caches', {})
+    assert wind.downloadWindData(2012, coords + [(40.3, -80.3)], 'key', 'email', rate=1000) == 1
+    assert stub.requests == len(coords) + 1
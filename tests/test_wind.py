@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import wind
+
+
+@pytest.fixture
+def classes():
+    return wind.loadWindClasses()
+
+
+def test_bounds_follow_inclusive_flag(classes):
+    for wind_class, bound, inclusive in classes.dropna().itertuples(index=False):
+        below = wind_class + 1
+        assert wind.windClasses(bound, classes) == (wind_class if inclusive else below)
+        assert wind.windClasses(np.nextafter(bound, np.inf), classes) == wind_class
+        assert wind.windClasses(np.nextafter(bound, -np.inf), classes) == below
+
+
+def test_atb_table_bounds():
+    speeds = [9.01, 9.0, 8.8, 8.79, 8.6, 8.4, 8.1, 7.6, 7.1, 6.5, 5.9, 5.89]
+
+    assert wind.windClasses(speeds).tolist() == [1, 2, 2, 3, 3, 4, 5, 6, 7, 8, 9, 10]
+
+
+def test_lowest_class(classes):
+    lowest = classes['CLASS'].iloc[-1]
+
+    assert wind.windClasses([np.nan, 0.0, -1.0, 5.0], classes).tolist() == [lowest] * 4
+
+
+def test_custom_table():
+    classes = pd.DataFrame({'CLASS': [1, 2, 3], 'MIN_SPEED_(m/s)': [8.0, 6.0, np.nan], 'INCLUSIVE': [1, 0, 1]})
+
+    assert wind.windClasses([8.0, 7.9, 6.0, 6.1, np.nan], classes).tolist() == [1, 2, 3, 2, 3]
+
+
+def test_shapes(classes):
+    assert wind.windClasses(np.empty(0), classes).shape == (0,)
+    assert wind.windClasses(np.full((2, 3), 9.5), classes).tolist() == [[1] * 3] * 2
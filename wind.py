@@ -1,232 +1,265 @@
 import pandas as pd
 import numpy as np
 import argparse
-import geopandas as gpd
-from shapely.geometry import Point
+import functools
 import os
 
+if __package__:
+    from . import download, cache, sites, runner, instrument
+    from .instrument import logger
+else:  # run as a script, or imported from the repository directory
+    import download
+    import cache
+    import sites
+    import runner
+    import instrument
+    from instrument import logger
+
 local_path = os.path.dirname(os.path.abspath(__file__))
 
+# Resource cache dataset for 100 m hub height WIND Toolkit data (other hub heights: wtkDataset())
+WTK_DATASET = 'wtk_100m'
+
+# WIND Toolkit SRW download endpoint
+WTK_URL = 'https://developer.nrel.gov/api/wind-toolkit/v2/wind/wtk-srw-download'
+
+# Hub heights (m) the WIND Toolkit SRW download serves
+HUB_HEIGHTS = [10, 40, 60, 80, 100, 120, 140, 160, 200]
+
+# Adapted from NREL ATB 2021: lower wind speed bound (m/s) of each wind class
+WIND_CLASSES_FILE = os.path.join(local_path, 'ATB/ATB2021_WindClasses.csv')
+
+# Generic turbine power curve for the capacity factor proxy (m/s): cubic from cut-in to rated speed, zero past cut-out
+CUT_IN_SPEED = 3.0
+RATED_SPEED = 12.0
+CUT_OUT_SPEED = 25.0
+
 # CLI arguments
 parser = argparse.ArgumentParser(description='Command line arguments for data extraction and cost calculations')
 parser.add_argument('--data_year', type=int, choices=[2010, 2011, 2012, 2013, 2014], help='Year of data extraction. '
                                                                                           'Must be in 2010-2014 ('
                                                                                           'inclusive).', required=True)
-parser.add_argument('--api_key', type=str, help='NREL API Key. Sign up @ https://developer.nrel.gov/signup/',
-                    required=True)
-parser.add_argument('--email', type=str, help='Email address.', required=True)
-parser.add_argument('--geometry', type=str, help='Option for choosing sites.', choices=['grid', 'state'], required=True)
-parser.add_argument('--min_lat', type=float, help='Required if geometry=grid')
-parser.add_argument('--max_lat', type=float, help='Required if geometry=grid')
-parser.add_argument('--min_lon', type=float, help='Required if geometry=grid')
-parser.add_argument('--max_lon', type=float, help='Required if geometry=grid')
-parser.add_argument('--states', nargs='+', type=str,
-                    help="Required if geometry=state, e.g. 'PA OH NY'.. Input == 'CONTINENTAL' for entire US.")
-parser.add_argument('--deg_resolution', type=float, default=.04, help='Approximate resolution of coordinate grid. '
-                                                                      'Used for geometry=state or geometry=grid,'
-                                                                      'default .04')
-
-args = parser.parse_args()
-
-
-def getWindData(year, lat, lon):  # Source code from ijbd (GitHub user)
-    """ by year and coordinate --> retrieves wind resource data from NREL's WIND Toolkit, and cost data from ATB 2021
-    """
+runner.addArguments(parser, 'wind', 'WIND Toolkit', 'WIND Toolkit grid (~.02 deg)')
+parser.add_argument('--hub_heights', nargs='+', type=int, choices=HUB_HEIGHTS, default=[100],
+                    help='Hub heights (m) to fetch and summarize, e.g. 80 100 120 140. Several heights add one set '
+                         'of wind columns per height, suffixed _{height}m. Default: 100')
+parser.add_argument('--wind_stats', action='store_true',
+                    help='Also output mean and P90 wind speed, and a capacity factor proxy for every site')
+instrument.addArguments(parser)
 
-    windCSV = os.path.join(local_path, f'wind_data_output/{lat}_{lon}_wtk.csv')
-
-    if not os.path.exists(windCSV):
-        wtk_url = 'https://developer.nrel.gov/api/wind-toolkit/v2/wind/wtk-srw-download'
-
-        params = {'api_key': args.api_key,
-                  'email': args.email,
-                  'lat': lat,
-                  'lon': lon,
-                  'hubheight': 100,
-                  'year': year,
-                  'utc': 'true'
-                  }
-
-        params_str = '&'.join([f'{key}={params[key]}' for key in params])
-        download_url = f'{wtk_url}?{params_str}'
-        print(download_url)
-
-        # Save resource CSV files
-        windResource = pd.read_csv(download_url)
-        windResource.to_csv(windCSV, index=False)
-
-    # Find wind speed
-    windSpeed100 = np.median(pd.read_csv(windCSV, skiprows=[0, 1, 3, 4], usecols=['Speed']).values)
-
-    # Adapted from NREL ATB 2021 .. wind speed (m/s)
-    if windSpeed100 > 9.0:
-        windClass = 1
-    elif windSpeed100 >= 8.8:
-        windClass = 2
-    elif windSpeed100 >= 8.6:
-        windClass = 3
-    elif windSpeed100 >= 8.4:
-        windClass = 4
-    elif windSpeed100 >= 8.1:
-        windClass = 5
-    elif windSpeed100 >= 7.6:
-        windClass = 6
-    elif windSpeed100 >= 7.1:
-        windClass = 7
-    elif windSpeed100 >= 6.5:
-        windClass = 8
-    elif windSpeed100 >= 5.9:
-        windClass = 9
-    else:
-        windClass = 10
-
-    return lat, lon, windSpeed100, windClass
 
+def wtkDataset(height=100):
+    """ Resource cache dataset of one hub height """
+    return f'wtk_{height}m'
 
-def getWindCosts():
-    """Load NREL ATB data for access to future cost projections (2021-2035)"""
 
-    atb_path = os.path.join(local_path, 'ATB/ATB2021.csv')
-    atb = pd.read_csv(atb_path)
+def windURL(year, lat, lon, api_key, email, height=100):
+    """ WIND Toolkit (SRW format) download url for one coordinate and hub height """
 
-    wind_atb = atb[['TECH', 'YEAR', 'CAPEX_($/MW)', 'FOPEX_($/MW)']]
+    params = {'api_key': api_key,
+              'email': email,
+              'lat': lat,
+              'lon': lon,
+              'hubheight': height,
+              'year': year,
+              'utc': 'true'
+              }
 
-    wind_atb = wind_atb[wind_atb['TECH'] == 'Wind']
-    del wind_atb['TECH']
+    params_str = '&'.join([f'{key}={params[key]}' for key in params])
 
-    convert_dict = {'YEAR': int,
-                    'CAPEX_($/MW)': float,
-                    'FOPEX_($/MW)': float
-                    }
+    return f'{WTK_URL}?{params_str}'
 
-    wind_atb = wind_atb.astype(convert_dict).reset_index(drop=True)
 
-    print(wind_atb)
-    print(wind_atb.dtypes)
+def storeWindData(store, lat, lon, content):
+    """ Parse a downloaded SRW file and add it to the resource cache """
+    meta, frame = cache.readSRW(content)
+    store.put(lat, lon, frame, meta)
 
-    return wind_atb
 
+def downloadWindData(year, coords, api_key, email, workers=4, rate=1.0, retries=5, heights=(100,)):
+    """ Concurrently download WIND Toolkit data for every coordinate and hub height that is not cached yet, as one
+    batch of requests """
 
-def getCoords():  # Source code from ijbd (GitHub user)
-    if args.geometry == 'grid':
-        coordinates = []
+    stores = {height: cache.openCache(wtkDataset(height), year) for height in heights}
 
-        lat = args.min_lat
-        while lat <= args.max_lat:
-            lon = args.min_lon
-            while lon <= args.max_lon:
-                coordinates.append((lat, lon))
-                lon += args.deg_resolution
-            lat += args.deg_resolution
-        return coordinates
+    # Requested once per canonical site, so the urls (and archive keys) are stable too
+    coords = list(dict.fromkeys(cache.siteKey(lat, lon) for lat, lon in coords))
 
-    states = args.states
-    if 'CONTINENTAL' in args.states:
-        states = ['AL', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'DC', 'FL', 'GA', 'ID', 'IL',
-                  'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO',
-                  'MT', 'NE', 'NV', 'NH', 'NH', 'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR',
-                  'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI',
-                  'WY']
+    missing = []
+    for height, store in stores.items():
+        # Sites cached by other shard workers since the cache was opened
+        store.refresh()
+        missing += [(height, lat, lon) for lat, lon in coords if (lat, lon) not in store]
 
-    # get outer bounds
-    usShp = gpd.read_file(os.path.join(local_path, 'states/s_11au16.shp'))
-    statesShp = usShp[usShp['STATE'].isin(states)]
+    instrument.count('cache_hits', len(coords) * len(stores) - len(missing))
+    instrument.count('downloads', len(missing))
 
-    coordinates = []
+    def save(i, content):
+        height, lat, lon = missing[i]
+        storeWindData(stores[height], lat, lon, content)
 
-    bounds = statesShp.total_bounds
+    download.fetchAll([windURL(year, lat, lon, api_key, email, height) for height, lat, lon in missing], save,
+                      workers=workers, rate=rate, retries=retries)
 
-    min_lon = round(bounds[0], 2)
-    min_lat = round(bounds[1], 2)
-    max_lon = round(bounds[2], 2)
-    max_lat = round(bounds[3], 2)
+    return len(missing)
 
-    lat = min_lat
 
-    while lat <= max_lat:
-        lon = min_lon
-        while lon <= max_lon:
-            if statesShp.contains(Point(lon, lat)).any():
-                coordinates.append((lat, lon))
-            lon += args.deg_resolution
-        lat += args.deg_resolution
+def readSpeeds(store, coords):
+    """ Hourly wind speeds of several sites (sites x hours), in one gather from the cache """
 
-    return coordinates
+    speed = store.matrix(coords, ['Speed'])[:, 0, :].astype(np.float64)
 
+    # float32 cache values rounded back to the published decimals, so the median and the class cut-offs match the
+    # values in the downloaded file
+    return np.round(speed, 4, out=speed)
 
-def mergeData():
-    year = args.data_year
-    timespan = range(2021, 2031)
 
-    wind_atb = getWindCosts()
+def powerCurveCF(speed):
+    """ Wind speeds (m/s, array of any shape) --> capacity factors from the generic power curve """
+
+    cf = np.clip((speed ** 3 - CUT_IN_SPEED ** 3) / (RATED_SPEED ** 3 - CUT_IN_SPEED ** 3), 0, 1)
+    cf[speed >= CUT_OUT_SPEED] = 0
+
+    return cf
+
+
+def windStats(speed):
+    """ Mean and P90 wind speed, and a capacity factor proxy from the generic power curve, for one site (1-D) or
+    per site (sites x hours) """
+    return speed.mean(axis=-1), np.percentile(speed, 90, axis=-1), powerCurveCF(speed).mean(axis=-1)
+
+
+@functools.lru_cache(maxsize=None)
+def loadWindClasses(path=WIND_CLASSES_FILE):
+    """ ATB wind class table: CLASS, MIN_SPEED_(m/s) (empty for the lowest class) and INCLUSIVE (1: speed >= bound,
+    0: speed > bound), fastest class first. Parsed once per process (callers must not modify it) """
+
+    classes = pd.read_csv(path)
+
+    return classes.sort_values('MIN_SPEED_(m/s)', ascending=False, na_position='last').reset_index(drop=True)
+
+
+def windClasses(speeds, classes=None):
+    """ Median wind speeds (any number of sites) --> ATB wind classes, in one broadcast comparison against every
+    class bound. The first (fastest) class whose bound a speed meets wins; speeds below every bound, or NaN, get the
+    lowest class """
 
-    print(getCoords())
-    coords = getCoords()
-    print(f'{len(coords)} coordinates found...')
+    if classes is None:
+        classes = loadWindClasses()
 
-    data = []
-    for i in range(len(coords)):
-        lat = coords[i][0]
-        lon = coords[i][1]
+    speeds = np.asarray(speeds, dtype=np.float64)[..., None]
+    bounds = classes['MIN_SPEED_(m/s)'].to_numpy(dtype=np.float64)
+    inclusive = classes['INCLUSIVE'].to_numpy(dtype=bool)
 
-        data.append(getWindData(year, lat, lon))
+    meets = np.where(inclusive, speeds >= bounds, speeds > bounds)
+    first = np.where(meets.any(axis=-1), meets.argmax(axis=-1), len(classes) - 1)
 
-    windCosts = pd.DataFrame(data, columns=('lat', 'lon', 'windSpeed', 'windClass'))
+    return classes['CLASS'].to_numpy()[first]
 
-    for y in timespan:
-        if y == 2021:
-            windCosts.loc[:, 'CAPEX_($/MW)_2021'] = wind_atb.iloc[0]['CAPEX_($/MW)']
-            windCosts.loc[:, 'FOPEX_($/MW)_2021'] = wind_atb.iloc[0]['FOPEX_($/MW)']
 
-        elif y == 2022:
-            windCosts.loc[:, 'CAPEX_($/MW)_2022'] = wind_atb.iloc[1]['CAPEX_($/MW)']
-            windCosts.loc[:, 'FOPEX_($/MW)_2022'] = wind_atb.iloc[1]['FOPEX_($/MW)']
+def summarizeWind(store, coords, stats=False, classes=None, batch_size=1000):
+    """ Median wind speed and ATB wind class (plus mean/P90 speed and CF proxy with stats=True) for every site in
+    one store, as columns in coords order. Speeds are gathered and reduced in batches of sites """
 
-        elif y == 2023:
-            windCosts.loc[:, 'CAPEX_($/MW)_2023'] = wind_atb.iloc[2]['CAPEX_($/MW)']
-            windCosts.loc[:, 'FOPEX_($/MW)_2023'] = wind_atb.iloc[2]['FOPEX_($/MW)']
+    summary = {name: [] for name in ('windSpeed', 'windSpeedMean', 'windSpeedP90', 'windCF')}
+    progress = instrument.Progress(len(coords), 'sites')
 
-        elif y == 2024:
-            windCosts.loc[:, 'CAPEX_($/MW)_2024'] = wind_atb.iloc[3]['CAPEX_($/MW)']
-            windCosts.loc[:, 'FOPEX_($/MW)_2024'] = wind_atb.iloc[3]['FOPEX_($/MW)']
+    for start in range(0, len(coords), batch_size):
+        speed = readSpeeds(store, coords[start:start + batch_size])
+        progress.update(len(speed))
+        summary['windSpeed'].append(np.median(speed, axis=1))
+        if stats:
+            for name, values in zip(('windSpeedMean', 'windSpeedP90', 'windCF'), windStats(speed)):
+                summary[name].append(values)
 
-        elif y == 2025:
-            windCosts.loc[:, 'CAPEX_($/MW)_2025'] = wind_atb.iloc[4]['CAPEX_($/MW)']
-            windCosts.loc[:, 'FOPEX_($/MW)_2025'] = wind_atb.iloc[4]['FOPEX_($/MW)']
+    columns = {name: np.concatenate(values) if values else np.empty(0) for name, values in summary.items()}
+    columns['windClass'] = windClasses(columns['windSpeed'], classes)
 
-        elif y == 2026:
-            windCosts.loc[:, 'CAPEX_($/MW)_2026'] = wind_atb.iloc[5]['CAPEX_($/MW)']
-            windCosts.loc[:, 'FOPEX_($/MW)_2026'] = wind_atb.iloc[5]['FOPEX_($/MW)']
+    order = ['windSpeed', 'windClass'] + (['windSpeedMean', 'windSpeedP90', 'windCF'] if stats else [])
 
-        elif y == 2027:
-            windCosts.loc[:, 'CAPEX_($/MW)_2027'] = wind_atb.iloc[6]['CAPEX_($/MW)']
-            windCosts.loc[:, 'FOPEX_($/MW)_2027'] = wind_atb.iloc[6]['FOPEX_($/MW)']
+    return {name: columns[name] for name in order}
 
-        elif y == 2028:
-            windCosts.loc[:, 'CAPEX_($/MW)_2028'] = wind_atb.iloc[7]['CAPEX_($/MW)']
-            windCosts.loc[:, 'FOPEX_($/MW)_2028'] = wind_atb.iloc[7]['FOPEX_($/MW)']
 
-        elif y == 2029:
-            windCosts.loc[:, 'CAPEX_($/MW)_2029'] = wind_atb.iloc[8]['CAPEX_($/MW)']
-            windCosts.loc[:, 'FOPEX_($/MW)_2029'] = wind_atb.iloc[8]['FOPEX_($/MW)']
+def getWindData(year, lat, lon, api_key=None, email=None, retries=5,
+                stats=False, height=100):  # Source code from ijbd (GitHub user)
+    """ by year and coordinate --> retrieves wind resource data from NREL's WIND Toolkit, and cost data from ATB 2021
+    """
+
+    store = cache.openCache(wtkDataset(height), year)
+
+    if (lat, lon) not in store:
+        download_url = windURL(year, lat, lon, api_key, email, height)
+
+        # Save resource data to the cache
+        storeWindData(store, lat, lon, download.fetchUrl(download_url, retries=retries))
+
+    summary = summarizeWind(store, [(lat, lon)], stats)
+
+    return (lat, lon) + tuple(values[0].item() for values in summary.values())
+
+
+def getWindCosts():
+    """Load NREL ATB data for access to future cost projections (2021-2035)"""
+    return sites.getAtbCosts('Wind')
 
-        else:
-            windCosts.loc[:, 'CAPEX_($/MW)_2030'] = wind_atb.iloc[9]['CAPEX_($/MW)']
-            windCosts.loc[:, 'FOPEX_($/MW)_2030'] = wind_atb.iloc[9]['FOPEX_($/MW)']
+
+def siteCosts(coords, year, api_key, email, workers=4, rate=1.0, retries=5, stats=False, snap=False, cost_years=None,
+              tidy=False, heights=(100,)):
+    """ Wind resource and ATB cost projections for a list of (lat, lon) coordinates, as a DataFrame. Resource data
+    that is not cached yet is downloaded with the given credentials; nothing is printed or written to the outputs.
+    cost_years selects the ATB projection years (default: all in the ATB file), tidy=True returns one row per site
+    and year instead of one cost column pair per year. snap=True fetches each native grid cell once and fans its
+    results out to every requested point in it.
+    stats=True adds mean/P90 wind speed and a capacity factor proxy per site. heights: hub heights (m) fetched in
+    one batch; with more than one, every wind column is repeated per height with a _{height}m suffix """
+
+    wind_atb = getWindCosts()
+
+    # Optionally resolve requested points to unique native grid cells first
+    cells, inverse = sites.snapCoords(coords, sites.NATIVE_RESOLUTION['wtk']) if snap else (coords, None)
+
+    with instrument.stage('download', rows_in=len(cells)) as stage:
+        stage.rows_out = downloadWindData(year, cells, api_key, email, workers, rate, retries, heights)
+
+    classes = loadWindClasses()
+
+    with instrument.stage('summarize', rows_in=len(cells) * len(heights)) as stage:
+        windCosts = pd.DataFrame({'lat': [lat for lat, lon in cells], 'lon': [lon for lat, lon in cells]})
+        for height in heights:
+            summary = summarizeWind(cache.openCache(wtkDataset(height), year), list(cells), stats, classes)
+            for name, values in summary.items():
+                windCosts[name if len(heights) == 1 else f'{name}_{height}m'] = values
+        stage.rows_out = len(windCosts)
+
+    with instrument.stage('costs', rows_in=len(windCosts)) as stage:
+        if inverse is not None:
+            windCosts = sites.fanOut(windCosts, coords, inverse, ('wtkLat', 'wtkLon'))
+
+        windCosts = sites.projectCosts(windCosts, wind_atb, cost_years, tidy)
+        stage.rows_out = len(windCosts)
 
     return windCosts
 
 
-def main():
-    print(f'local path: {local_path}')  # quick check
+def argsCosts(args, coords):
+    """ siteCosts() with the command line options """
+    return siteCosts(coords, args.data_year, args.api_key, args.email, workers=args.workers,
+                     rate=args.requests_per_second, retries=args.retries, stats=args.wind_stats,
+                     snap=args.snap_to_grid, cost_years=args.cost_years, tidy=args.tidy, heights=args.hub_heights)
+
 
-    windCosts = mergeData()
+def main(argv=None):
+    args = parser.parse_args(argv)
+    instrument.configure(args)
+    download.configure(args)
 
-    out_path = os.path.join(local_path, 'wind_data_output/wind_costs.csv')
+    logger.debug(f'local path: {local_path}')  # quick check
+    logger.debug(getWindCosts())
 
-    windCosts.to_csv(out_path, index=False)
+    runner.run(args, 'wind', lambda coords: argsCosts(args, coords),
+               runner.runParams(args, 'wind_stats', 'hub_heights'), [WIND_CLASSES_FILE, os.path.abspath(__file__)])
 
-    print('That\'s all folks!')
+    logger.info('That\'s all folks!')
 
 
 if __name__ == '__main__':